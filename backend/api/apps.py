@@ -2,4 +2,9 @@ from django.apps import AppConfig
 
 
 class ApiConfig(AppConfig):
-    name = 'api'
+    name = 'backend.api'
+    label = 'api'
+
+    def ready(self):
+        """Connect signal handlers."""
+        from . import db, signals  # noqa: F401
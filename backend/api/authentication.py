@@ -0,0 +1,87 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.authentication import TokenAuthentication
+
+from .caching import generation
+
+
+# revocations would not reach other workers, or cost a query anyway
+UNSHARED_CACHES = (DatabaseCache, DummyCache, LocMemCache)
+
+
+class _LocalTokens(object):
+    """Bounded, least recently used first out map of validated tokens."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, token_generation):
+        """Cached (user, token) of `key` unless expired or revoked."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, entry_generation, credentials = entry
+            if entry_generation != token_generation\
+                    or expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return credentials
+
+    def set(self, key, token_generation, credentials):
+        """Remember (user, token) of `key`."""
+        with self._lock:
+            self._entries[key] = (
+                time.monotonic() + settings.TOKEN_CACHE_TIMEOUT,
+                token_generation,
+                credentials,
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Forget all tokens."""
+        with self._lock:
+            self._entries.clear()
+
+
+_local = _LocalTokens()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication skipping the database for known tokens.
+
+    Validated tokens are kept in process and in the shared cache for
+    TOKEN_CACHE_TIMEOUT seconds. Deleting a token or saving a user revokes
+    all of them at once, see signals. Without a shared cache every request
+    is checked against the database.
+    """
+
+    def authenticate_credentials(self, key):
+        """User and token of `key`, cached."""
+        if isinstance(caches['default'], UNSHARED_CACHES):
+            return super().authenticate_credentials(key)
+        token_generation = generation('tokens')
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        credentials = _local.get(digest, token_generation)
+        if credentials is not None:
+            return credentials
+        shared_key = 'api:tokens:{}:{}'.format(token_generation, digest)
+        credentials = cache.get(shared_key)
+        if credentials is None:
+            # raises for unknown tokens and inactive users, never cached
+            credentials = super().authenticate_credentials(key)
+            cache.set(shared_key, credentials, settings.TOKEN_CACHE_TIMEOUT)
+        _local.set(digest, token_generation, credentials)
+        return credentials
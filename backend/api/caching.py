@@ -0,0 +1,101 @@
+import functools
+import hashlib
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from rest_framework.response import Response
+
+
+CACHED_HEADERS = ('Cache-Control', 'ETag', 'Last-Modified')
+
+# time of the last write, replicas may lag behind it
+WRITTEN_KEY = 'api:written'
+
+
+def _generation_key(namespace):
+    return 'api:{}:generation'.format(namespace)
+
+
+def generation(namespace):
+    """Current generation token of cached responses in `namespace`."""
+    key = _generation_key(namespace)
+    token = cache.get(key)
+    if token is None:
+        # a fresh token never matches entries cached before an eviction
+        cache.add(key, uuid4().hex, None)
+        token = cache.get(key)
+    return token
+
+
+def invalidate(*namespaces):
+    """Drop all cached responses in `namespaces` once the write commits.
+
+    A request reading between the write and the commit caches old rows
+    under the current generation, only a later bump drops them.
+    """
+    def bump():
+        tokens = {
+            _generation_key(namespace): uuid4().hex
+            for namespace in namespaces
+        }
+        tokens[WRITTEN_KEY] = time.time()
+        cache.set_many(tokens, None)
+
+    transaction.on_commit(bump)
+
+
+def is_cacheable(request):
+    """Only safe, anonymous requests share cached responses."""
+    return request.method in ('GET', 'HEAD')\
+        and not request.user.is_authenticated
+
+
+def response_key(request, namespace, params):
+    """Cache key of path, media type and the params shaping the response."""
+    query = sorted(
+        (param, request.query_params.getlist(param))
+        for param in params if param in request.query_params
+    )
+    digest = hashlib.md5(repr((
+        request.get_host(), request.path, request.accepted_media_type, query
+    )).encode()).hexdigest()
+    return 'api:{}:{}:{}'.format(namespace, generation(namespace), digest)
+
+
+def cache_response(view_method):
+    """Serve viewset method from cache for anonymous safe requests.
+
+    Uses `cache_namespace` and `cache_query_params` of the viewset.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if not is_cacheable(request):
+            return view_method(self, request, *args, **kwargs)
+        key = response_key(request,
+                           self.cache_namespace,
+                           self.cache_query_params)
+        cached = cache.get(key)
+        if cached is None:
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, (response.data, {
+                    header: response[header]
+                    for header in CACHED_HEADERS if response.has_header(header)
+                }), settings.API_CACHE_TIMEOUT)
+            return response
+        data, headers = cached
+        response = Response(data, headers=headers)
+        return get_conditional_response(
+            request,
+            etag=headers.get('ETag'),
+            last_modified=parse_http_date_safe(
+                headers.get('Last-Modified', '')
+            ),
+            response=response,
+        )
+    return wrapper
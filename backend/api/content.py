@@ -0,0 +1,200 @@
+import json
+import os
+import shutil
+from collections import defaultdict
+from pathlib import PurePosixPath
+
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+
+from . import feed
+from .models import Attachment, Entity, EventDetails, EventParticipants, Post
+from .search import update_search_vector
+from .storage import upload_storage
+
+
+ENTITY_FIELDS = ('id', 'name', 'url', 'image', 'type', 'updated')
+POST_FIELDS = ('id', 'title', 'content', 'content_html', 'header', 'slider',
+               'created', 'updated')
+EVENT_FIELDS = ('id', 'start', 'end', 'place')
+PARTICIPANTS_FIELDS = ('id', 'label')
+ATTACHMENT_FIELDS = ('id', 'name', 'file', 'updated')
+
+# auto_now fields bulk_create would overwrite, restored afterwards
+TIMESTAMPS = {
+    Attachment: ('updated', ),
+    Entity: ('updated', ),
+    Post: ('created', 'updated'),
+}
+
+Membership = EventParticipants.entities.through
+
+
+def dumps(record):
+    """One NDJSON line of `record`."""
+    return json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_records(chunk_size):
+    """Entities, then posts with nested event data and attachments.
+
+    Posts are read in id ranges of `chunk_size`, five queries each, so
+    memory use does not grow with the number of posts.
+    """
+    for entity in Entity.objects.order_by('id').values(*ENTITY_FIELDS)\
+            .iterator(chunk_size=chunk_size):
+        yield {'model': 'entity', 'data': entity}
+    last = 0
+    while True:
+        posts = list(Post.objects.filter(id__gt=last).order_by('id')
+                     .values(*POST_FIELDS)[:chunk_size])
+        if not posts:
+            return
+        last = posts[-1]['id']
+        ids = [post['id'] for post in posts]
+        events = {
+            event.pop('post_id'): event for event in EventDetails.objects
+            .filter(post_id__in=ids).values('post_id', *EVENT_FIELDS)
+        }
+        members = defaultdict(list)
+        for participants_id, entity_id in Membership.objects\
+                .filter(eventparticipants__post_id__in=ids)\
+                .order_by('id')\
+                .values_list('eventparticipants_id', 'entity_id'):
+            members[participants_id].append(entity_id)
+        participants = defaultdict(list)
+        for item in EventParticipants.objects.filter(post_id__in=ids)\
+                .order_by('id').values('post_id', *PARTICIPANTS_FIELDS):
+            item['entities'] = members[item['id']]
+            participants[item.pop('post_id')].append(item)
+        attachments = defaultdict(list)
+        for item in Attachment.objects.filter(post_id__in=ids)\
+                .order_by('id').values('post_id', *ATTACHMENT_FIELDS):
+            attachments[item.pop('post_id')].append(item)
+        for post in posts:
+            post['event'] = events.get(post['id'])
+            post['participants'] = participants[post['id']]
+            post['attachments'] = attachments[post['id']]
+            yield {'model': 'post', 'data': post}
+
+
+def media_names(record):
+    """Names of stored files `record` references."""
+    data = record['data']
+    names = [data.get('image') or data.get('header')]
+    names += [item['file'] for item in data.get('attachments', ())]
+    return [name for name in names if name]
+
+
+class Importer(object):
+    """Create exported rows in batches with their primary keys.
+
+    Run it inside a transaction, call `flush` after the last record.
+    """
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.model = None
+        self.records = []
+        self.counts = defaultdict(int)
+
+    def add(self, record):
+        """Queue `record`, writing a batch when full or the model changes."""
+        if record.get('model') not in ('entity', 'post'):
+            raise ValueError('unknown model {!r}'.format(record.get('model')))
+        if record['model'] != self.model or \
+                len(self.records) >= self.chunk_size:
+            self.flush()
+            self.model = record['model']
+        self.records.append(record['data'])
+
+    def flush(self):
+        """Write queued records."""
+        if self.records:
+            if self.model == 'entity':
+                self.create(Entity, [
+                    Entity(**data) for data in self.records
+                ])
+            else:
+                self.create_posts(self.records)
+        self.records = []
+
+    def create_posts(self, records):
+        """Write posts with their event data and attachments."""
+        events, participants, members, attachments = [], [], [], []
+        for data in records:
+            event = data.pop('event')
+            if event:
+                events.append(EventDetails(post_id=data['id'], **event))
+            for item in data.pop('participants'):
+                for entity_id in item.pop('entities'):
+                    members.append(Membership(
+                        eventparticipants_id=item['id'], entity_id=entity_id
+                    ))
+                participants.append(EventParticipants(post_id=data['id'],
+                                                      **item))
+            attachments += [Attachment(post_id=data['id'], **item)
+                            for item in data.pop('attachments')]
+        posts = [Post(**data) for data in records]
+        self.create(Post, posts)
+        self.create(EventDetails, events)
+        self.create(EventParticipants, participants)
+        self.create(Membership, members)
+        self.create(Attachment, attachments)
+        ids = [post.id for post in posts]
+        update_search_vector(Post.objects.filter(id__in=ids))
+        feed.refresh(ids)
+
+    def create(self, model, instances):
+        """Bulk create `instances` keeping their timestamps."""
+        if not instances:
+            return
+        fields = TIMESTAMPS.get(model, ())
+        timestamps = [[getattr(instance, field) for field in fields]
+                      for instance in instances]
+        model.objects.bulk_create(instances)
+        if fields:
+            for instance, values in zip(instances, timestamps):
+                for field, value in zip(fields, values):
+                    setattr(instance, field, value)
+            model.objects.bulk_update(instances, fields)
+        self.counts[model._meta.verbose_name_plural] += len(instances)
+
+    def reset_sequences(self):
+        """Move id sequences past the imported primary keys."""
+        models = (Entity, Post, EventDetails, EventParticipants, Membership,
+                  Attachment)
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+
+def export_media(tar, names):
+    """Add stored files `names` to `tar`, return names of missing ones."""
+    missing = []
+    for name in names:
+        try:
+            tar.add(upload_storage.path(name), arcname=name,
+                    recursive=False)
+        except FileNotFoundError:
+            missing.append(name)
+    return missing
+
+
+def import_media(tar):
+    """Write regular files of `tar` to storage, keep existing ones.
+
+    Yields names of written files.
+    """
+    for member in tar:
+        path = PurePosixPath(member.name)
+        if not member.isfile() or path.is_absolute() or '..' in path.parts:
+            continue
+        if upload_storage.exists(member.name):
+            continue
+        target = upload_storage.path(member.name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with tar.extractfile(member) as source, open(target, 'wb') as file:
+            shutil.copyfileobj(source, file)
+        yield member.name
@@ -0,0 +1,70 @@
+import time
+import weakref
+from collections import Counter
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .metrics import registry
+
+
+# database wrappers of all threads, whether they hold a connection or not
+_wrappers = weakref.WeakSet()
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    """Track opened database connections."""
+    _wrappers.add(connection)
+    registry.increment('api_db_connections_created_total',
+                       {'alias': connection.alias})
+
+
+@receiver(request_started)
+def check_connections(sender, **kwargs):
+    """Close persistent connections that broke while idle.
+
+    Runs after Django dropped connections older than CONN_MAX_AGE, the
+    next query of the request then opens a fresh one. Only connections
+    idle for DB_HEALTH_CHECK_IDLE seconds are checked, busy workers skip
+    the round trip.
+    """
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    now = time.monotonic()
+    for connection in connections.all():
+        idle_since = getattr(connection, 'idle_since', None)
+        if connection.connection is None\
+                or connection.in_atomic_block\
+                or idle_since is not None\
+                and now - idle_since < settings.DB_HEALTH_CHECK_IDLE\
+                or connection.is_usable():
+            continue
+        connection.close()
+        registry.increment('api_db_connections_unusable_total',
+                           {'alias': connection.alias})
+
+
+@receiver(request_finished)
+def mark_idle(sender, **kwargs):
+    """Remember when connections kept open went idle."""
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.idle_since = now
+
+
+def open_connections():
+    """Connections held by this process, per alias."""
+    return [
+        ({'alias': alias}, count) for alias, count in Counter(
+            wrapper.alias for wrapper in list(_wrappers)
+            if wrapper.connection is not None
+        ).items()
+    ]
+
+
+registry.gauge('api_db_connections_open', open_connections)
@@ -0,0 +1,40 @@
+import random
+import threading
+
+from django.db import connections
+
+
+_state = threading.local()
+
+
+def replicas():
+    """Aliases of read replicas."""
+    return [alias for alias in connections if alias != 'default']
+
+
+def use_replicas(enabled):
+    """Route reads of the current thread to replicas, or back to primary."""
+    _state.replica = random.choice(replicas() or [None]) if enabled else None
+
+
+class ReplicaRouter(object):
+    """Reads go to a replica while enabled by ReplicaMiddleware.
+
+    Writes, migrations and reads outside of such requests use `default`.
+    """
+
+    def db_for_read(self, model, **hints):
+        """Replica picked for the request, primary otherwise."""
+        return getattr(_state, 'replica', None) or 'default'
+
+    def db_for_write(self, model, **hints):
+        """Always the primary."""
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Replicas hold the same rows as the primary."""
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Replicas get their schema by replication."""
+        return db == 'default'
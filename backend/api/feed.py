@@ -0,0 +1,73 @@
+import json
+import threading
+from contextlib import contextmanager
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from .models import Post, PostFeed
+from .serializers import PostsSerializerList
+
+
+_local = threading.local()
+
+
+def refresh(ids):
+    """Rebuild feed rows of posts `ids`, dropping those of deleted posts."""
+    ids = set(ids)
+    if not ids:
+        return
+    posts = list(Post.objects.filter(id__in=ids)
+                 .select_related('eventdetails')
+                 .prefetch_related('attachment_set', 'eventparticipants_set')
+                 .defer('content', 'content_html', 'search_vector'))
+    # serialized without request, URLs are made absolute when read
+    rows = [
+        PostFeed(id=post.id,
+                 event=data['eventdetails'] is not None,
+                 updated=post.updated,
+                 payload=json.dumps(data, cls=DjangoJSONEncoder))
+        for post, data in zip(posts,
+                              PostsSerializerList(posts, many=True).data)
+    ]
+    with transaction.atomic():
+        PostFeed.objects.filter(id__in=ids).delete()
+        PostFeed.objects.bulk_create(rows)
+
+
+def changed(ids):
+    """Refresh feed rows of posts `ids`, at the end of `batched` if in it."""
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        refresh(ids)
+    else:
+        pending.update(ids)
+
+
+@contextmanager
+def batched():
+    """Refresh posts changed inside the block once, when it ends."""
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+    _local.pending = pending = set()
+    try:
+        yield
+    finally:
+        _local.pending = None
+    refresh(pending)
+
+
+def rebuild(chunk_size):
+    """Refresh feed rows of all posts, return their number."""
+    count = last = 0
+    while True:
+        ids = list(Post.objects.filter(id__gt=last).order_by('id')
+                   .values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            break
+        refresh(ids)
+        count += len(ids)
+        last = ids[-1]
+    PostFeed.objects.exclude(id__in=Post.objects.values('id')).delete()
+    return count
@@ -0,0 +1,380 @@
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.client import encode_multipart
+from django.test.utils import (CaptureQueriesContext,
+                               override_settings,
+                               setup_databases,
+                               setup_test_environment,
+                               teardown_databases,
+                               teardown_test_environment)
+from django.utils import timezone
+from markdownx.utils import markdownify
+
+from backend.api.feed import rebuild
+from backend.api.models import (Attachment,
+                                Entity,
+                                EventDetails,
+                                EventParticipants,
+                                Post)
+from backend.api.search import update_search_vector
+
+
+CONTENT = '''# {title}
+
+Lorem ipsum dolor sit amet, **consectetur** adipiscing elit. Sed do
+eiusmod tempor incididunt ut labore et dolore magna aliqua.
+
+## Program
+
+{items}
+
+Więcej informacji na [stronie wydarzenia](https://example.com/{slug}).
+'''
+
+# name: method, path, authenticated
+ENDPOINTS = (
+    ('posts', ('GET', '/api/posts/', False)),
+    ('posts-events', ('GET', '/api/posts/?only=events', False)),
+    ('posts-markdownify', ('GET', '/api/posts/?markdownify', False)),
+    ('post-detail', ('GET', '/api/posts/{post}/', False)),
+    ('entities-member', ('GET', '/api/entities/?type=member', False)),
+    ('upload', ('PUT', '/api/upload/', True)),
+)
+
+PERCENTILES = (50, 90, 99)
+
+BOUNDARY = 'BenchmarkBoundary'
+MULTIPART_CONTENT = 'multipart/form-data; boundary={}'.format(BOUNDARY)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted `values`."""
+    return values[max(int(round(p / 100 * len(values))) - 1, 0)]
+
+
+class Command(BaseCommand):
+    """Benchmark API hot paths on seeded test database."""
+
+    help = 'Seed a test database and measure latency percentiles and '\
+        'queries per request of the API hot paths.'
+
+    def add_arguments(self, parser):
+        """Command arguments."""
+        parser.add_argument('--posts', default=2000, type=int)
+        parser.add_argument('--entities', default=300, type=int)
+        parser.add_argument('--events', default=.5, type=float,
+                            help='Fraction of posts that are events.')
+        parser.add_argument('--participants', default=3, type=int,
+                            help='Participant groups per event.')
+        parser.add_argument('--attachments', default=2, type=int,
+                            help='Attachments per post.')
+        parser.add_argument('--requests', default=200, type=int,
+                            help='Measured requests per endpoint.')
+        parser.add_argument('--warmup', default=10, type=int)
+        parser.add_argument('--upload-size', default=256, type=int,
+                            help='Uploaded file size in KiB.')
+        parser.add_argument('--endpoint', action='append',
+                            choices=[name for name, _ in ENDPOINTS],
+                            help='Endpoint to measure, all by default.')
+        parser.add_argument('--cached', action='store_true',
+                            help='Keep the API response cache on.')
+        parser.add_argument('--seed', default=0, type=int)
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--url',
+                            help='Measure a running server instead, e.g. '
+                            'http://localhost:8000.')
+        parser.add_argument('--token',
+                            help='Auth token for --url write endpoints.')
+        parser.add_argument('--concurrency', default=1, type=int,
+                            help='Requests in flight, with --url.')
+        parser.add_argument('--output', help='Write JSON report to file.')
+        parser.add_argument('--compare', help='Baseline JSON report.')
+
+    def handle(self, *args, **options):
+        """Seed, measure and report."""
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        if options['url']:
+            report = self.measure(options, self.http_sender(options))
+        else:
+            if options['concurrency'] > 1:
+                raise CommandError('--concurrency needs --url.')
+            report = self.measure_test_client(options)
+
+        self.print_report(report, baseline)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+    def measure_test_client(self, options):
+        """Measure through test client on seeded test database."""
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0,
+                                     interactive=False,
+                                     keepdb=options['keepdb'])
+        media_root = tempfile.mkdtemp()
+        # upload view expects the temporary directory to exist
+        os.mkdir(os.path.join(media_root, 'tmp'))
+        try:
+            with override_settings(
+                MEDIA_ROOT=media_root,
+                API_CACHE_TIMEOUT=None if options['cached'] else 0,
+                IMAGE_VARIANTS_ASYNC=False,
+            ):
+                if not Post.objects.exists():
+                    self.seed(options)
+                return self.measure(options, self.test_client_sender(),
+                                    database=connection.vendor)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+            teardown_databases(old_config,
+                               verbosity=0,
+                               keepdb=options['keepdb'])
+            teardown_test_environment()
+
+    def seed(self, options):
+        """Create posts, events, participants, entities and attachments."""
+        rnd = random.Random(options['seed'])
+        started = time.perf_counter()
+        contents = []
+        for i in range(5):
+            content = CONTENT.format(
+                title='Wydarzenie {}'.format(i),
+                items='\n'.join('- punkt {}'.format(j)
+                                for j in range(5 * (i + 1))),
+                slug='wydarzenie-{}'.format(i),
+            )
+            contents.append((content, markdownify(content)))
+
+        Entity.objects.bulk_create([
+            Entity(name='Podmiot {}'.format(i),
+                   url='https://example.com/{}'.format(i),
+                   type=rnd.choice((1, 2)))
+            for i in range(options['entities'])
+        ], batch_size=500)
+        entity_ids = list(Entity.objects.values_list('id', flat=True))
+
+        posts = []
+        for i in range(options['posts']):
+            content, content_html = rnd.choice(contents)
+            posts.append(Post(title='Wpis {}'.format(i),
+                              content=content,
+                              content_html=content_html,
+                              slider=rnd.random() < .05))
+        Post.objects.bulk_create(posts, batch_size=500)
+        post_ids = list(Post.objects.values_list('id', flat=True))
+        update_search_vector(Post.objects.all())
+
+        now = timezone.now()
+        event_ids = rnd.sample(post_ids,
+                               int(len(post_ids) * options['events']))
+        details = []
+        for post_id in event_ids:
+            start = now + timedelta(days=rnd.randint(-365, 365),
+                                    hours=rnd.randint(0, 23))
+            details.append(EventDetails(post_id=post_id,
+                                        start=start,
+                                        end=start + timedelta(hours=2),
+                                        place='Sala {}'.format(post_id)))
+        EventDetails.objects.bulk_create(details, batch_size=500)
+
+        EventParticipants.objects.bulk_create([
+            EventParticipants(post_id=post_id, label='Grupa {}'.format(i))
+            for post_id in event_ids
+            for i in range(options['participants'])
+        ], batch_size=500)
+        through = EventParticipants.entities.through
+        through.objects.bulk_create([
+            through(eventparticipants_id=participants_id, entity_id=entity_id)
+            for participants_id in EventParticipants.objects
+            .values_list('id', flat=True)
+            for entity_id in rnd.sample(entity_ids, min(5, len(entity_ids)))
+        ], batch_size=500)
+
+        Attachment.objects.bulk_create([
+            Attachment(post_id=post_id,
+                       name='Załącznik {}'.format(i),
+                       file='attachment-{}-{}.pdf'.format(post_id, i))
+            for post_id in post_ids
+            for i in range(options['attachments'])
+        ], batch_size=500)
+
+        rebuild(500)
+
+        User.objects.create_superuser('benchmark',
+                                      'benchmark@example.com',
+                                      'benchmark')
+        self.stdout.write('Seeded {} post(s) in {:.1f}s.'.format(
+            len(post_ids), time.perf_counter() - started
+        ))
+
+    def test_client_sender(self):
+        """Send requests in process, counting queries."""
+        anonymous = Client()
+        authenticated = Client()
+        authenticated.force_login(User.objects.get(username='benchmark'))
+        post = EventDetails.objects.order_by('post_id').first()
+
+        def send(method, path, login, body=None):
+            client = authenticated if login else anonymous
+            path = path.format(post=post.post_id if post else 0)
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = client.generic(
+                    method, path, body or '',
+                    MULTIPART_CONTENT if body else 'application/octet-stream'
+                )
+                elapsed = time.perf_counter() - started
+            return (response.status_code, elapsed, len(context),
+                    len(response.content))
+        return send
+
+    def http_sender(self, options):
+        """Send requests to a running server at `--url`."""
+        base = options['url'].rstrip('/')
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = 'Token {}'.format(options['token'])
+
+        def send(method, path, login, body=None):
+            request = Request(base + path.format(**posts),
+                              data=body,
+                              method=method,
+                              headers=dict(
+                                  headers,
+                                  **({'Content-Type': MULTIPART_CONTENT}
+                                     if body else {})
+                              ))
+            started = time.perf_counter()
+            try:
+                with urlopen(request) as response:
+                    status, size = response.status, len(response.read())
+            except HTTPError as e:
+                status, size = e.code, 0
+            return status, time.perf_counter() - started, None, size
+
+        posts = {'post': 0}
+        with urlopen(base + '/api/posts/?only=events&fields=id') as response:
+            results = json.load(response)['results']
+        if results:
+            posts['post'] = results[0]['id']
+        return send
+
+    def measure(self, options, send, database=None):
+        """Latency percentiles, throughput and queries of each endpoint."""
+        names = options['endpoint'] or [name for name, _ in ENDPOINTS]
+        upload = b'x' * options['upload_size'] * 1024
+
+        def request(method, path, login, i):
+            body = None
+            if method == 'PUT':
+                body = encode_multipart(BOUNDARY, {
+                    'file': SimpleUploadedFile('benchmark-{}.bin'.format(i),
+                                               upload),
+                })
+            return send(method, path, login, body)
+
+        endpoints = {}
+        for name in names:
+            method, path, login = dict(ENDPOINTS)[name]
+            if login and options['url'] and not options['token']:
+                self.stderr.write('Skipped {}, needs --token.'.format(name))
+                continue
+            if not options['url']:
+                cache.clear()
+            for i in range(options['warmup']):
+                self.check_response(name, request(method, path, login, i))
+            started = time.perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as executor:
+                results = list(executor.map(
+                    lambda i: request(method, path, login, i),
+                    range(options['requests'])
+                ))
+            elapsed = time.perf_counter() - started
+            for result in results:
+                self.check_response(name, result)
+            timings = sorted(result[1] for result in results)
+            queries = [result[2] for result in results
+                       if result[2] is not None]
+            endpoints[name] = dict(
+                {'p{}'.format(p): round(percentile(timings, p) * 1000, 3)
+                 for p in PERCENTILES},
+                method=method,
+                path=path,
+                mean=round(sum(timings) / len(timings) * 1000, 3),
+                queries=max(queries) if queries else None,
+                size=max(result[3] for result in results),
+                throughput=round(len(results) / elapsed, 1),
+            )
+
+        return {
+            'environment': {
+                'database': database,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'target': options['url'] or 'test client',
+            },
+            'options': {
+                key: options[key] for key in (
+                    'attachments', 'cached', 'concurrency', 'entities',
+                    'events', 'participants', 'posts', 'requests', 'seed',
+                    'upload_size', 'warmup',
+                )
+            },
+            'endpoints': endpoints,
+        }
+
+    def check_response(self, name, result):
+        """Fail on error responses, they would skew the numbers."""
+        if result[0] >= 400:
+            raise CommandError('{} answered {}.'.format(name, result[0]))
+
+    def print_report(self, report, baseline=None):
+        """Table of latencies in ms, with change against `baseline`."""
+        columns = ['p{}'.format(p) for p in PERCENTILES]\
+            + ['mean', 'throughput']
+        self.stdout.write('{:<20}{}{:>9}{:>10}'.format(
+            'endpoint',
+            ''.join('{:>18}'.format(column) for column in columns),
+            'queries',
+            'bytes',
+        ))
+        for name, result in sorted(report['endpoints'].items()):
+            previous = (baseline or {}).get('endpoints', {}).get(name)
+            cells = []
+            for column in columns:
+                cell = '{:.2f}'.format(result[column])
+                if previous and previous.get(column):
+                    cell += ' ({:+.0%})'.format(
+                        result[column] / previous[column] - 1
+                    )
+                cells.append('{:>18}'.format(cell))
+            queries = '-' if result['queries'] is None\
+                else str(result['queries'])
+            if previous and previous.get('queries') is not None\
+                    and result['queries'] is not None\
+                    and previous['queries'] != result['queries']:
+                queries = '{}->{}'.format(previous['queries'], queries)
+            self.stdout.write('{:<20}{}{:>9}{:>10}'.format(
+                name, ''.join(cells), queries, result['size']
+            ))
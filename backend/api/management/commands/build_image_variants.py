@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from backend.api.models import Entity, Post
+from backend.api.utils.variants import build_variants
+
+
+class Command(BaseCommand):
+    """Render missing variants of all images."""
+
+    help = 'Render missing variants of post headers and entity images.'
+
+    def handle(self, *args, **options):
+        """Render variants synchronously."""
+        images = [post.header for post in Post.objects
+                  .exclude(header='').exclude(header__isnull=True)
+                  .only('id', 'header').iterator()]\
+            + [entity.image for entity in Entity.objects
+               .exclude(image='').exclude(image__isnull=True)
+               .only('id', 'image').iterator()]
+        for image in images:
+            try:
+                build_variants(image, wait=True)
+            except (OSError, ValueError) as e:
+                self.stderr.write('{}: {}'.format(image.name, e))
+        self.stdout.write('Checked {} image(s).'.format(len(images)))
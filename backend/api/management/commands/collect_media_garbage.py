@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from backend.api.media import (delete,
+                               expired_uploads,
+                               orphan_variants,
+                               orphans)
+from backend.api.storage import upload_storage
+
+
+class Command(BaseCommand):
+    """Delete stored media no row references."""
+
+    help = 'Delete uploads, their variants and compressed siblings no '\
+        'longer referenced by attachments, entities or posts, and '\
+        'abandoned chunked uploads.'
+
+    def add_arguments(self, parser):
+        """Command arguments."""
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--grace', default=None, type=int,
+                            help='Keep files younger than this many '
+                            'seconds, MEDIA_GC_GRACE by default.')
+
+    def handle(self, *args, **options):
+        """Find orphans, delete them unless dry run."""
+        grace = settings.MEDIA_GC_GRACE if options['grace'] is None\
+            else options['grace']
+        names = list(orphans(grace))
+        others = list(orphan_variants()) + list(expired_uploads(grace))
+        for name in names + others:
+            self.stdout.write(name)
+        if not options['dry_run']:
+            for name in names:
+                delete(name)
+            for name in others:
+                upload_storage.delete(name)
+        self.stdout.write('{} {} file(s).'.format(
+            'Found' if options['dry_run'] else 'Deleted',
+            len(names) + len(others),
+        ))
@@ -0,0 +1,46 @@
+import sys
+import tarfile
+
+from django.core.management.base import BaseCommand
+
+from backend.api.content import dumps, export_media, export_records, \
+    media_names
+
+
+class Command(BaseCommand):
+    """Stream all content as NDJSON."""
+
+    help = 'Write entities and posts with their event data and attachments '\
+        'as one JSON record per line, optionally with a tar of media files.'
+
+    def add_arguments(self, parser):
+        """Command arguments."""
+        parser.add_argument('output', nargs='?', default='-',
+                            help='File to write, stdout by default.')
+        parser.add_argument('--chunk-size', default=500, type=int)
+        parser.add_argument('--media', default=None,
+                            help='Tar file to write referenced media to.')
+
+    def handle(self, *args, **options):
+        """Write records, and media files as they are referenced."""
+        output = sys.stdout if options['output'] == '-'\
+            else open(options['output'], 'w')
+        # streaming mode, members are written as they are added
+        tar = options['media'] and tarfile.open(options['media'], 'w|')
+        records = missing = 0
+        try:
+            for record in export_records(options['chunk_size']):
+                output.write(dumps(record))
+                records += 1
+                if tar:
+                    for name in export_media(tar, media_names(record)):
+                        self.stderr.write('Missing {}'.format(name))
+                        missing += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+            if tar:
+                tar.close()
+        self.stderr.write('Exported {} record(s), {} missing file(s).'.format(
+            records, missing
+        ))
@@ -0,0 +1,62 @@
+import json
+import sys
+import tarfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import Error, transaction
+
+from backend.api.caching import invalidate
+from backend.api.content import Importer, import_media
+
+
+class Command(BaseCommand):
+    """Load content written by export_content."""
+
+    help = 'Create entities and posts from NDJSON records in batches, all '\
+        'or nothing, keeping their ids. Run build_image_variants and '\
+        'precompress_media afterwards.'
+
+    def add_arguments(self, parser):
+        """Command arguments."""
+        parser.add_argument('input', nargs='?', default='-',
+                            help='File to read, stdin by default.')
+        parser.add_argument('--chunk-size', default=500, type=int)
+        parser.add_argument('--media', default=None,
+                            help='Tar file of media files to restore.')
+
+    def handle(self, *args, **options):
+        """Import records in one transaction, then media files."""
+        input = sys.stdin if options['input'] == '-'\
+            else open(options['input'])
+        importer = Importer(options['chunk_size'])
+        number = 0
+        try:
+            with transaction.atomic():
+                for number, line in enumerate(input, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        importer.add(json.loads(line))
+                    except (AttributeError, KeyError, TypeError,
+                            ValueError) as e:
+                        raise CommandError('Line {}: {}'.format(number, e))
+                    except Error as e:
+                        # a full batch is written when the next line comes
+                        raise CommandError('Lines up to {}: {}'.format(
+                            number - 1, e
+                        ))
+                try:
+                    importer.flush()
+                except Error as e:
+                    raise CommandError('Lines up to {}: {}'.format(number, e))
+                importer.reset_sequences()
+        finally:
+            if input is not sys.stdin:
+                input.close()
+        invalidate('attachments', 'entities', 'posts')
+        for name, count in sorted(importer.counts.items()):
+            self.stdout.write('Imported {} {}.'.format(count, name))
+        if options['media']:
+            with tarfile.open(options['media'], 'r|') as tar:
+                written = sum(1 for _ in import_media(tar))
+            self.stdout.write('Restored {} file(s).'.format(written))
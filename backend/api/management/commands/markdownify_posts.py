@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from markdownx.utils import markdownify
+
+from backend.api.models import Post
+
+
+class Command(BaseCommand):
+    """Pre-render markdown content of all posts."""
+
+    help = 'Render markdown content of all posts into stored HTML.'
+
+    def add_arguments(self, parser):
+        """Command arguments."""
+        parser.add_argument('--chunk-size', default=500, type=int)
+
+    def handle(self, *args, **options):
+        """Render posts whose stored HTML is out of date."""
+        rendered = 0
+        for id, content, content_html in Post.objects\
+                .values_list('id', 'content', 'content_html')\
+                .iterator(chunk_size=options['chunk_size']):
+            html = markdownify(content)
+            if html != content_html:
+                # queryset update keeps `updated` untouched
+                Post.objects.filter(id=id).update(content_html=html)
+                rendered += 1
+        self.stdout.write('Rendered {} post(s).'.format(rendered))
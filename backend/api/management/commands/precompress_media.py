@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from backend.api.models import Attachment
+from backend.api.utils.compress import precompress_file
+
+
+class Command(BaseCommand):
+    """Precompress all attachment files."""
+
+    help = 'Write missing .gz siblings of attachment files.'
+
+    def handle(self, *args, **options):
+        """Precompress synchronously."""
+        files = [attachment.file for attachment in Attachment.objects
+                 .only('id', 'file').iterator()]
+        for file in files:
+            precompress_file(file, wait=True)
+        self.stdout.write('Checked {} file(s).'.format(len(files)))
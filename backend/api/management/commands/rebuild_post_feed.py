@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from backend.api.feed import rebuild
+
+
+class Command(BaseCommand):
+    """Recompute the post feed."""
+
+    help = 'Rebuild precomputed /list/ payloads of all posts, needed after '\
+        'changes to the list serializer.'
+
+    def add_arguments(self, parser):
+        """Command arguments."""
+        parser.add_argument('--chunk-size', default=500, type=int)
+
+    def handle(self, *args, **options):
+        """Refresh feed rows in chunks."""
+        count = rebuild(options['chunk_size'])
+        self.stdout.write('Rebuilt {} post(s).'.format(count))
@@ -0,0 +1,113 @@
+from pathlib import Path
+import os
+import time
+
+from django.conf import settings
+
+from .models import Attachment, Entity, Post
+from .storage import upload_storage
+from .utils.compress import remove_precompressed
+from .utils.variants import variant_name
+
+
+# model fields referencing stored media files
+REFERENCES = (
+    (Attachment, 'file'),
+    (Entity, 'image'),
+    (Post, 'header'),
+)
+
+# suffixes of files written next to stored ones
+SIBLINGS = ('.gz', '.part')
+
+
+def is_referenced(name):
+    """Any row still uses stored file `name`."""
+    return any(model.objects.filter(**{field: name}).exists()
+               for model, field in REFERENCES)
+
+
+def referenced():
+    """Names of all stored files in use."""
+    names = set()
+    for model, field in REFERENCES:
+        names.update(model.objects
+                     .exclude(**{field: ''})
+                     .exclude(**{'{}__isnull'.format(field): True})
+                     .values_list(field, flat=True)
+                     .iterator())
+    return names
+
+
+def is_recent(name, grace=None):
+    """File `name` was written or reused within MEDIA_GC_GRACE seconds."""
+    grace = settings.MEDIA_GC_GRACE if grace is None else grace
+    try:
+        return time.time() - os.path.getmtime(upload_storage.path(name))\
+            < grace
+    except FileNotFoundError:
+        return False
+
+
+def delete(name):
+    """Delete stored file `name` with its variants and siblings."""
+    upload_storage.delete(name)
+    remove_precompressed(upload_storage.path(name))
+    for variant in settings.IMAGE_VARIANTS:
+        upload_storage.delete(variant_name(name, variant))
+
+
+def release(name):
+    """Delete stored file `name` once no row references it.
+
+    Recently written content-addressed files are left to
+    `collect_media_garbage`, an upload of the same content may be about to
+    reference them.
+    """
+    if not name or is_referenced(name)\
+            or name.startswith('cas/') and is_recent(name):
+        return
+    delete(name)
+
+
+def orphans(grace=None):
+    """Names of stored uploads no row references.
+
+    Only files at the top of MEDIA_ROOT and under cas/ are uploads, others
+    belong to tmp/, variants/ or third party apps.
+    """
+    root = Path(upload_storage.path(''))
+    names = referenced()
+    paths = [path for path in root.iterdir() if path.is_file()]
+    if (root / 'cas').is_dir():
+        paths += [path for path in (root / 'cas').glob('*/*')
+                  if path.is_file()]
+        paths += list((root / 'cas').glob('*.part'))
+    for path in paths:
+        name = path.relative_to(root).as_posix()
+        if name in names or is_recent(name, grace):
+            continue
+        # siblings go along with their original, uploads may end in .gz too
+        if path.suffix in SIBLINGS and path.with_suffix('').exists():
+            continue
+        yield name
+
+
+def expired_uploads(grace=None):
+    """Names of chunked uploads under tmp/ unchanged for MEDIA_GC_GRACE."""
+    root = Path(upload_storage.path(''))
+    if (root / 'tmp').is_dir():
+        for path in (root / 'tmp').iterdir():
+            name = path.relative_to(root).as_posix()
+            if path.is_file() and not is_recent(name, grace):
+                yield name
+
+
+def orphan_variants():
+    """Names of variants of images no longer referenced."""
+    root = Path(upload_storage.path(''))
+    stems = {Path(name).stem for name in referenced()}
+    if (root / 'variants').is_dir():
+        for path in (root / 'variants').glob('*/*.webp'):
+            if path.stem not in stems:
+                yield path.relative_to(root).as_posix()
@@ -0,0 +1,177 @@
+import bisect
+import threading
+from collections import OrderedDict
+
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name, help, buckets
+HISTOGRAMS = OrderedDict((
+    ('api_request_duration_seconds',
+     ('Wall time of the request.', LATENCY_BUCKETS)),
+    ('api_request_db_seconds',
+     ('Time spent executing database queries.', LATENCY_BUCKETS)),
+    ('api_request_queries',
+     ('Database queries executed.', QUERIES_BUCKETS)),
+    ('api_request_serializer_seconds',
+     ('Time spent in the view outside of database queries.',
+      LATENCY_BUCKETS)),
+    ('api_request_render_seconds',
+     ('Time spent rendering the response.', LATENCY_BUCKETS)),
+    ('api_response_size_bytes',
+     ('Size of the response body.', SIZE_BUCKETS)),
+))
+
+# name, help
+COUNTERS = OrderedDict((
+    ('api_db_connections_created_total',
+     'Database connections opened.'),
+    ('api_db_connections_unusable_total',
+     'Reused database connections found broken and closed.'),
+))
+
+# name, help
+GAUGES = OrderedDict((
+    ('api_db_connections_open',
+     'Database connections held open by this process.'),
+))
+
+
+class Histogram(object):
+    """Cumulative bucket counts, sum and count of observed values."""
+
+    __slots__ = (
+        'buckets',
+        'counts',
+        'sum',
+        'count',
+    )
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        """Record `value`."""
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            # values above the last bound only count towards +Inf
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry(object):
+    """Histograms of requests, labelled by route, action and method.
+
+    Also counters and gauges of database connections, labelled by alias.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {name: {} for name in HISTOGRAMS}
+        self._counters = {name: {} for name in COUNTERS}
+        self._gauges = {}
+
+    def increment(self, name, labels, value=1):
+        """Add `value` to counter `name` for `labels`."""
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            counters = self._counters[name]
+            counters[labels] = counters.get(labels, 0) + value
+
+    def gauge(self, name, collect):
+        """Read gauge `name` at scrape time from `collect()`.
+
+        It returns a list of (labels, value) pairs.
+        """
+        self._gauges[name] = collect
+
+    def observe(self, labels, values):
+        """Record `values`, a dict of metric name to value, for `labels`."""
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            for name, value in values.items():
+                if value is None:
+                    continue
+                histograms = self._histograms[name]
+                if labels not in histograms:
+                    histograms[labels] = Histogram(HISTOGRAMS[name][1])
+                histograms[labels].observe(value)
+
+    def clear(self):
+        """Forget all observations."""
+        with self._lock:
+            for histograms in self._histograms.values():
+                histograms.clear()
+            for counters in self._counters.values():
+                counters.clear()
+
+    def render(self):
+        """Prometheus text exposition format of all metrics."""
+        lines = []
+        gauges = {name: self._gauges[name]() for name in GAUGES
+                  if name in self._gauges}
+        with self._lock:
+            for name, (help, buckets) in HISTOGRAMS.items():
+                lines.append('# HELP {} {}'.format(name, help))
+                lines.append('# TYPE {} histogram'.format(name))
+                for labels, histogram in sorted(
+                        self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(buckets, histogram.counts):
+                        cumulative += count
+                        lines.append('{}_bucket{} {}'.format(
+                            name,
+                            _labels(labels + (('le', _number(bound)), )),
+                            cumulative
+                        ))
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _labels(labels + (('le', '+Inf'), )),
+                        histogram.count
+                    ))
+                    lines.append('{}_sum{} {}'.format(
+                        name, _labels(labels), _number(histogram.sum)
+                    ))
+                    lines.append('{}_count{} {}'.format(
+                        name, _labels(labels), histogram.count
+                    ))
+            for name, help in COUNTERS.items():
+                lines.append('# HELP {} {}'.format(name, help))
+                lines.append('# TYPE {} counter'.format(name))
+                for labels, value in sorted(self._counters[name].items()):
+                    lines.append('{}{} {}'.format(
+                        name, _labels(labels), _number(value)
+                    ))
+        for name, help in GAUGES.items():
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} gauge'.format(name))
+            for labels, value in sorted(
+                    (tuple(sorted(labels.items())), value)
+                    for labels, value in gauges.get(name, ())):
+                lines.append('{}{} {}'.format(
+                    name, _labels(labels), _number(value)
+                ))
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels):
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\')
+            .replace('"', '\\"')
+            .replace('\n', '\\n')
+        ) for name, value in labels
+    ) + '}'
+
+
+registry = Registry()
@@ -0,0 +1,168 @@
+import json
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .caching import WRITTEN_KEY
+from .metrics import registry
+from .db_routers import replicas, use_replicas
+
+
+logger = logging.getLogger('backend.api.metrics')
+
+
+class _RequestMetrics(object):
+    """Timings of a single request."""
+
+    __slots__ = (
+        'route',
+        'action',
+        'queries',
+        'db_time',
+        'view_start',
+        'view_db_time',
+        'view_end',
+        'render_start',
+        'render_end',
+    )
+
+    def __init__(self):
+        self.route = self.action = None
+        self.queries = 0
+        self.db_time = self.view_db_time = 0
+        self.view_start = self.view_end = None
+        self.render_start = self.render_end = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+
+class MetricsMiddleware(object):
+    """Per endpoint latency, query count and response size.
+
+    Enabled with API_METRICS, keep it first in MIDDLEWARE so wall time
+    covers the whole stack. Observations go to the in-process registry
+    scraped at /api/metrics/ and are logged as JSON lines.
+    """
+
+    def __init__(self, get_response):
+        if not settings.API_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = request._metrics = _RequestMetrics()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            response = self.get_response(request)
+        end = time.perf_counter()
+        if metrics.route is not None:
+            self.record(request, response, metrics, end - start)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = request._metrics
+        match = request.resolver_match
+        metrics.route = match.view_name or match.route
+        actions = getattr(view_func, 'actions', None) or {}
+        method = request.method.lower()
+        metrics.action = actions.get(method)\
+            or (method == 'head' and actions.get('get'))\
+            or method
+        metrics.view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        metrics = request._metrics
+        metrics.view_end = metrics.render_start = time.perf_counter()
+        metrics.view_db_time = metrics.db_time
+
+        def rendered(response):
+            metrics.render_end = time.perf_counter()
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, metrics, duration):
+        """Observe and log metrics of a finished request."""
+        if metrics.view_end is None:
+            # not a template response, the view rendered its own body
+            metrics.view_end = time.perf_counter()
+            metrics.view_db_time = metrics.db_time
+        serializer_time = None
+        if metrics.view_start is not None:
+            serializer_time = max(metrics.view_end - metrics.view_start
+                                  - metrics.view_db_time, 0)
+        render_time = None
+        if metrics.render_end is not None:
+            render_time = metrics.render_end - metrics.render_start
+        size = None if response.streaming else len(response.content)
+        labels = {
+            'route': metrics.route,
+            'action': metrics.action,
+            'method': request.method,
+        }
+        registry.observe(labels, {
+            'api_request_duration_seconds': duration,
+            'api_request_db_seconds': metrics.db_time,
+            'api_request_queries': metrics.queries,
+            'api_request_serializer_seconds': serializer_time,
+            'api_request_render_seconds': render_time,
+            'api_response_size_bytes': size,
+        })
+        logger.info(json.dumps(dict(
+            labels,
+            status=response.status_code,
+            duration=round(duration, 6),
+            db_time=round(metrics.db_time, 6),
+            queries=metrics.queries,
+            serializer_time=serializer_time and round(serializer_time, 6),
+            render_time=render_time and round(render_time, 6),
+            size=size,
+        ), sort_keys=True))
+
+
+class ReplicaMiddleware(object):
+    """Serve safe API requests from read replicas.
+
+    Clients that have just written, and everyone shortly after any write,
+    stay on the primary for REPLICA_LAG seconds so they read their writes
+    despite replication lag.
+    """
+
+    cookie = 'primary'
+
+    def __init__(self, get_response):
+        if not replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        safe = request.method in ('GET', 'HEAD', 'OPTIONS')
+        use_replicas(
+            safe
+            and request.path.startswith('/api/')
+            and self.cookie not in request.COOKIES
+            and time.time() - (cache.get(WRITTEN_KEY) or 0)
+            > settings.REPLICA_LAG
+        )
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replicas(False)
+        if not safe and response.status_code < 400:
+            response.set_cookie(self.cookie, '1',
+                                max_age=settings.REPLICA_LAG,
+                                httponly=True)
+        return response
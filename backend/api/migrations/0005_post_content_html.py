@@ -0,0 +1,27 @@
+# Generated by Django 2.2.1 on 2026-10-17 18:06
+
+from django.db import migrations, models
+from markdownx.utils import markdownify
+
+
+def render_content(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    for post in Post.objects.only('id', 'content').iterator():
+        Post.objects.filter(id=post.id)\
+            .update(content_html=markdownify(post.content))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_auto_20210712_1917'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='content_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(render_content, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.1 on 2026-10-17 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_post_content_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='entity',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 2.2.1 on 2026-10-17 18:11
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE INDEX api_post_search_vector_gin '
+                          'ON api_post USING gin (search_vector)')
+    # the expression of search.search_vector as of this migration
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_ts_config WHERE cfgname = %s',
+                       [settings.SEARCH_CONFIG])
+        config = settings.SEARCH_CONFIG if cursor.fetchone() else 'simple'
+    schema_editor.execute(
+        'UPDATE api_post SET search_vector = '
+        "setweight(to_tsvector(%s::regconfig, COALESCE(title, '')), 'A') || "
+        "setweight(to_tsvector(%s::regconfig, COALESCE(content, '')), 'B')",
+        [config, config]
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX api_post_search_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_entity_attachment_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.1 on 2026-10-17 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_post_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='eventdetails',
+            index=models.Index(fields=['start'], name='api_eventde_start_7b70b4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventdetails',
+            index=models.Index(fields=['end'], name='api_eventde_end_50ed2f_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.1 on 2026-10-17 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_eventdetails_start_end_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(slider=True), fields=['-id'], name='api_post_slider_idx'),
+        ),
+    ]
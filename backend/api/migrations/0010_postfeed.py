@@ -0,0 +1,28 @@
+# Generated by Django 2.2.1 on 2026-10-17 18:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_post_slider_index'),
+    ]
+
+    # rows are filled by rebuild_post_feed, run by the entrypoints, the
+    # payloads come from the live list serializer
+    operations = [
+        migrations.CreateModel(
+            name='PostFeed',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('event', models.BooleanField(default=False)),
+                ('updated', models.DateTimeField()),
+                ('payload', models.TextField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='postfeed',
+            index=models.Index(fields=['event', '-id'], name='api_postfee_event_eee402_idx'),
+        ),
+    ]
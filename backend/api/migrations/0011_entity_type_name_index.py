@@ -0,0 +1,17 @@
+# Generated by Django 2.2.1 on 2026-10-17 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_postfeed'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(fields=['type', 'name'], name='api_entity_type_94f485_idx'),
+        ),
+    ]
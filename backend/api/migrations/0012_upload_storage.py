@@ -0,0 +1,31 @@
+# Generated by Django 2.2.1 on 2026-10-17 18:52
+
+import backend.api.storage
+import backend.api.utils.uuid4path
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_entity_type_name_index'),
+    ]
+
+    # storage does not touch the schema, SQLite would rebuild the tables
+    operations = [migrations.SeparateDatabaseAndState(state_operations=[
+        migrations.AlterField(
+            model_name='attachment',
+            name='file',
+            field=models.FileField(storage=backend.api.storage.MediaStorage(), upload_to=backend.api.utils.uuid4path.Uuid4Path()),
+        ),
+        migrations.AlterField(
+            model_name='entity',
+            name='image',
+            field=models.ImageField(null=True, storage=backend.api.storage.MediaStorage(), upload_to=backend.api.utils.uuid4path.Uuid4Path()),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='header',
+            field=models.ImageField(blank=True, null=True, storage=backend.api.storage.MediaStorage(), upload_to=backend.api.utils.uuid4path.Uuid4Path()),
+        ),
+    ])]
@@ -0,0 +1,227 @@
+import hashlib
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.response import Response
+
+from .caching import cache_response
+from .signals import bulk_saved
+from .utils.bulk import bulk_create
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class _Preloaded(object):
+    """Related objects loaded up front, queried like a queryset."""
+
+    __slots__ = (
+        '_objects',
+    )
+
+    def __init__(self, objects):
+        self._objects = objects
+
+    def get(self, pk):
+        try:
+            return self._objects[int(pk)]
+        except KeyError:
+            raise ObjectDoesNotExist
+
+
+class BulkMixin(object):
+    """Bulk create, update and delete, each in a single transaction.
+
+    POST /bulk/ takes a list of objects, PATCH a list of partial objects
+    with `id` and DELETE a list of ids. Invalid input is answered with a
+    list of errors, one per item, and nothing is written.
+    """
+
+    @action(detail=False, methods=['post', 'patch', 'delete'])
+    def bulk(self, request, *args, **kwargs):
+        """Bulk create, update or delete."""
+        if not isinstance(request.data, list):
+            raise ValidationError({
+                'non_field_errors': ['Oczekiwano listy.'],
+            })
+        with transaction.atomic():
+            return getattr(self, '_bulk_{}'.format(request.method.lower()))(
+                request.data
+            )
+
+    def _bulk_post(self, data):
+        serializer = self.get_serializer(data=data, many=True)
+        self._preload_related([serializer.child], data)
+        serializer.is_valid(raise_exception=True)
+        model = self.get_queryset().model
+        instances = bulk_create(model, [
+            model(**self._prepare(serializer.child, attrs))
+            for attrs in serializer.validated_data
+        ])
+        bulk_saved.send(sender=model, instances=instances)
+        return Response(self.get_serializer(instances, many=True).data,
+                        status=status.HTTP_201_CREATED)
+
+    def _bulk_patch(self, data):
+        queryset = self.get_queryset()
+        instances = queryset.in_bulk([
+            item['id'] for item in data
+            if isinstance(item, dict) and _is_id(item.get('id'))
+        ])
+        serializers = [
+            self.get_serializer(
+                instances.get(item.get('id'))
+                if isinstance(item, dict) and _is_id(item.get('id'))
+                else None,
+                data=item,
+                partial=True
+            ) for item in data
+        ]
+        self._preload_related(serializers, data)
+        errors = [
+            {'id': ['Nie znaleziono.']} if serializer.instance is None
+            else {} if serializer.is_valid()
+            else serializer.errors
+            for serializer in serializers
+        ]
+        if any(errors):
+            raise ValidationError(errors)
+        model = queryset.model
+        now = timezone.now()
+        auto_now = [field.name for field in model._meta.concrete_fields
+                    if getattr(field, 'auto_now', False)]
+        fields = set(auto_now)
+        for serializer in serializers:
+            attrs = self._prepare(serializer,
+                                  dict(serializer.validated_data))
+            for attr, value in attrs.items():
+                setattr(serializer.instance, attr, value)
+            for attr in auto_now:
+                setattr(serializer.instance, attr, now)
+            fields.update(attrs)
+        changed = list({
+            serializer.instance.pk: serializer.instance
+            for serializer in serializers
+        }.values())
+        if changed and fields:
+            model.objects.bulk_update(changed, fields)
+        bulk_saved.send(sender=model, instances=changed)
+        return Response(self.get_serializer(changed, many=True).data)
+
+    def _bulk_delete(self, data):
+        queryset = self.get_queryset()
+        ids = [id for id in data if _is_id(id)]
+        instances = queryset.in_bulk(ids)
+        errors = [
+            {} if _is_id(id) and id in instances
+            else {'id': ['Nie znaleziono.']}
+            for id in data
+        ]
+        if any(errors):
+            raise ValidationError(errors)
+        queryset.filter(pk__in=ids).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def _preload_related(self, serializers, data):
+        # resolve primary keys of each relation for all items in one query
+        for name, field in serializers[0].fields.items()\
+                if serializers else ():
+            if field.read_only\
+                    or not isinstance(field, PrimaryKeyRelatedField):
+                continue
+            ids = set()
+            for item in data:
+                try:
+                    ids.add(int(item[name]))
+                except (KeyError, TypeError, ValueError):
+                    pass
+            preloaded = _Preloaded(field.get_queryset().in_bulk(ids))
+            for serializer in serializers:
+                serializer.fields[name].queryset = preloaded
+
+    def _prepare(self, serializer, attrs):
+        # move already uploaded files into place
+        return serializer._move_uploaded(attrs)\
+            if hasattr(serializer, '_move_uploaded') else attrs
+
+
+class CachedResponseMixin(object):
+    """Shared cache of anonymous list and retrieve responses."""
+
+    cache_namespace = None
+    cache_query_params = ()
+
+    @cache_response
+    def list(self, request, *args, **kwargs):
+        """Cached list."""
+        return super().list(request, *args, **kwargs)
+
+    @cache_response
+    def retrieve(self, request, *args, **kwargs):
+        """Cached retrieve."""
+        return super().retrieve(request, *args, **kwargs)
+
+
+class ConditionalGetMixin(object):
+    """ETag / Last-Modified validators and 304 for list and retrieve."""
+
+    updated_field = 'updated'
+
+    def list(self, request, *args, **kwargs):
+        """List, validators come from an aggregate over the queryset."""
+        aggregate = self.filter_queryset(self.get_queryset())\
+            .aggregate(count=Count('pk'), updated=Max(self.updated_field))
+        return self.conditional_response(
+            request,
+            aggregate['updated'],
+            (aggregate['count'], ),
+            lambda: super(ConditionalGetMixin, self)
+            .list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        """Retrieve, serializing only when the client copy is stale."""
+        instance = self.get_object()
+        return self.conditional_response(
+            request,
+            getattr(instance, self.updated_field),
+            (instance.pk, ),
+            lambda: Response(self.get_serializer(instance).data)
+        )
+
+    def etag(self, request, updated, validators):
+        """Quoted ETag of the response to `request`."""
+        return quote_etag(hashlib.md5(repr((
+            request.get_full_path(),
+            request.accepted_media_type,
+            updated and updated.isoformat(),
+        ) + tuple(validators)).encode()).hexdigest())
+
+    def conditional_response(self, request, updated, validators, view):
+        """Return 304 for a fresh client copy, call `view` otherwise."""
+        etag = self.etag(request, updated, validators)
+        last_modified = updated and int(updated.timestamp())
+        response = get_conditional_response(request,
+                                            etag=etag,
+                                            last_modified=last_modified)
+        if response is None:
+            response = view()
+        if 200 <= response.status_code < 300 or response.status_code == 304:
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            # always revalidate instead of heuristic freshness
+            patch_cache_control(response, no_cache=True)
+            patch_vary_headers(response, ('Accept', ))
+        return response
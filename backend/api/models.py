@@ -1,10 +1,13 @@
 from datetime import datetime
 
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.html import escape
 from markdownx.models import MarkdownxField
+from markdownx.utils import markdownify
 
+from .storage import upload_storage
 from .utils.uuid4path import Uuid4Path
 
 
@@ -15,6 +18,9 @@ TYPES_ENTITIES = (
     (2, 'other'),
 )
 
+# entity type by name
+ENTITY_TYPES = {name: key for key, name in TYPES_ENTITIES}
+
 
 def no_unsafe(value):
     """Validate against unsafe characters."""
@@ -29,32 +35,67 @@ class Post(models.Model):
 
     title = models.CharField(max_length=100, validators=[no_unsafe])
     content = MarkdownxField()
-    header = models.ImageField(blank=True, null=True, upload_to=Uuid4Path())
+    content_html = models.TextField(blank=True, default='', editable=False)
+    header = models.ImageField(blank=True, null=True, upload_to=Uuid4Path(),
+                               storage=upload_storage)
     slider = models.BooleanField(null=False, default=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    # maintained on PostgreSQL only, see search.py
+    search_vector = SearchVectorField(editable=False, null=True)
 
     class Meta:
         """Meta."""
 
+        indexes = (
+            # slider posts, newest first
+            models.Index(fields=('-id', ),
+                         name='api_post_slider_idx',
+                         condition=models.Q(slider=True)),
+        )
         ordering = ('created', )
 
     def __str__(self):
         """Model representation."""
         return "{}".format(self.title)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember content the stored HTML was rendered from."""
+        instance = super().from_db(db, field_names, values)
+        if 'content' in field_names:
+            instance._markdownified = values[field_names.index('content')]
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Render markdown content only when it has changed."""
+        if 'content' not in self.get_deferred_fields()\
+                and self.content != getattr(self, '_markdownified', None):
+            self.content_html = markdownify(self.content)
+            self._markdownified = self.content
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields'])\
+                    | {'content_html'}
+        super().save(*args, **kwargs)
+
 
 class Entity(models.Model):
     """Entity model."""
 
     name = models.CharField(max_length=100, validators=[no_unsafe])
     url = models.CharField(max_length=100, validators=[no_unsafe])
-    image = models.ImageField(null=True, upload_to=Uuid4Path())
+    image = models.ImageField(null=True, upload_to=Uuid4Path(),
+                              storage=upload_storage)
     type = models.IntegerField(choices=TYPES_ENTITIES)
+    updated = models.DateTimeField(auto_now=True)
 
     class Meta:
         """Meta."""
 
+        indexes = (
+            # entities of a type by name, also the whole directory
+            models.Index(fields=('type', 'name')),
+        )
         verbose_name_plural = "Entities"
 
     def __str__(self):
@@ -66,7 +107,8 @@ class Attachment(models.Model):
     """Attachment model."""
 
     name = models.CharField(max_length=100, validators=[no_unsafe])
-    file = models.FileField(upload_to=Uuid4Path())
+    file = models.FileField(upload_to=Uuid4Path(), storage=upload_storage)
+    updated = models.DateTimeField(auto_now=True)
     # relationships
     post = models.ForeignKey(Post, null=False, on_delete=models.CASCADE)
 
@@ -74,6 +116,19 @@ class Attachment(models.Model):
         """Model representation."""
         return "{}".format(self.name)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the post the attachment was stored with."""
+        instance = super().from_db(db, field_names, values)
+        if 'post_id' in field_names:
+            instance._stored_post_id = values[field_names.index('post_id')]
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Save, signals see the previous post of a moved attachment."""
+        super().save(*args, **kwargs)
+        self._stored_post_id = self.post_id
+
 
 class EventDetails(models.Model):
     """Event details model."""
@@ -88,6 +143,10 @@ class EventDetails(models.Model):
     class Meta:
         """Meta."""
 
+        indexes = (
+            models.Index(fields=('start', )),
+            models.Index(fields=('end', )),
+        )
         verbose_name_plural = "Events details"
 
     def __str__(self):
@@ -118,3 +177,27 @@ class EventParticipants(models.Model):
     def __str__(self):
         """Model representation."""
         return "{}".format(self.label)
+
+
+class PostFeed(models.Model):
+    """Precomputed /list/ payload of a post, kept up to date by signals.
+
+    The primary key is the post id. There is no foreign key, related rows
+    deleted along with a post may refresh its row before the post is gone.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    event = models.BooleanField(default=False)
+    updated = models.DateTimeField()
+    payload = models.TextField()
+
+    class Meta:
+        """Meta."""
+
+        indexes = (
+            models.Index(fields=('event', '-id')),
+        )
+
+    def __str__(self):
+        """Model representation."""
+        return "{}".format(self.id)
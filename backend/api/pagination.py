@@ -0,0 +1,18 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class PostsCursorPagination(CursorPagination):
+    """Keyset pagination over posts, newest first."""
+
+    ordering = '-id'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class PostsSearchPagination(PageNumberPagination):
+    """Page number pagination over posts ordered by search rank."""
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
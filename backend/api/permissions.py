@@ -0,0 +1,9 @@
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+
+class IsInternalAddress(BasePermission):
+    """Allow requests coming from INTERNAL_IPS only."""
+
+    def has_permission(self, request, view):
+        return request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS
@@ -0,0 +1,57 @@
+from django.utils import timezone
+from rest_framework import renderers
+
+
+def _escape(value):
+    return str(value)\
+        .replace('\\', '\\\\')\
+        .replace(';', '\\;')\
+        .replace(',', '\\,')\
+        .replace('\n', '\\n')
+
+
+def _fold(line):
+    # content lines are folded at 75 octets (RFC 5545, 3.1)
+    chunks, chunk = [], ''
+    for char in line:
+        if len((chunk + char).encode()) > 75:
+            chunks.append(chunk)
+            chunk = ' '
+        chunk += char
+    return '\r\n'.join(chunks + [chunk])
+
+
+class ICalendarRenderer(renderers.BaseRenderer):
+    """iCalendar renderer of events serialized by EventsSerializerICalendar."""
+
+    charset = 'utf-8'
+    format = 'ics'
+    media_type = 'text/calendar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render events to iCalendar."""
+        if not isinstance(data, list):  # error details
+            return str(data).encode(self.charset)
+        request = (renderer_context or {}).get('request', None)
+        host = request.get_host() if request else 'localhost'
+        stamp = timezone.now().strftime('%Y%m%dT%H%M%SZ')
+        lines = [
+            'BEGIN:VCALENDAR',
+            'VERSION:2.0',
+            'PRODID:-//{}//API//PL'.format(host),
+        ]
+        for event in data:
+            lines += [
+                'BEGIN:VEVENT',
+                'UID:post-{}@{}'.format(event['post'], host),
+                'DTSTAMP:{}'.format(stamp),
+                'DTSTART:{}'.format(event['start']),
+                'DTEND:{}'.format(event['end']),
+                'SUMMARY:{}'.format(_escape(event['title'])),
+            ]
+            if event['place']:
+                lines.append('LOCATION:{}'.format(_escape(event['place'])))
+            lines.append('END:VEVENT')
+        lines.append('END:VCALENDAR')
+        return ('\r\n'.join(_fold(line) for line in lines) + '\r\n')\
+            .encode(self.charset)
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery,
+                                            SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import F, Q
+
+
+_configs = {}
+
+
+def search_config():
+    """Text search configuration, `simple` when SEARCH_CONFIG is missing."""
+    if connection.alias not in _configs:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM pg_ts_config WHERE cfgname = %s',
+                           [settings.SEARCH_CONFIG])
+            _configs[connection.alias] = settings.SEARCH_CONFIG\
+                if cursor.fetchone() else 'simple'
+    return _configs[connection.alias]
+
+
+def search_vector(config):
+    """Weighted search vector over post title and content."""
+    return SearchVector('title', weight='A', config=config)\
+        + SearchVector('content', weight='B', config=config)
+
+
+def update_search_vector(queryset):
+    """Recompute search vector of posts in `queryset`."""
+    if connection.vendor == 'postgresql':
+        queryset.update(search_vector=search_vector(search_config()))
+
+
+def search_posts(queryset, query):
+    """Posts matching `query`, best first.
+
+    PostgreSQL uses the indexed search vector, other databases fall back to
+    matching and ranking terms in Python.
+    """
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(query, config=search_config())
+        return queryset\
+            .filter(search_vector=search_query)\
+            .annotate(rank=SearchRank(F('search_vector'), search_query))\
+            .order_by('-rank', '-id')
+    terms = query.lower().split()
+    for term in terms:
+        queryset = queryset.filter(Q(title__icontains=term)
+                                   | Q(content__icontains=term))
+    # ranking needs title and content, whatever fields are serialized
+    posts = list(queryset.defer(None))
+    for post in posts:
+        title, content = post.title.lower(), post.content.lower()
+        post.rank = sum(2 * title.count(term) + content.count(term)
+                        for term in terms)
+    return sorted(posts, key=lambda post: (-post.rank, -post.id))
@@ -1,22 +1,114 @@
-from pathlib import Path
-import io
-import mimetypes
+import copy
+import json
 
 from django.conf import settings
-from django.db import IntegrityError
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
 from rest_framework import serializers
 from markdownx.utils import markdownify
 
 from .models import Attachment, Entity, EventDetails, EventParticipants, Post
+from .utils.bulk import bulk_create
+from .utils.uploads import move_uploaded, temporary_path
+from .utils.variants import variant_name
 
 
 class MarkdownField(serializers.Field):
-    """Field containing markdown."""
+    """Field containing markdown rendered to HTML."""
+
+    def get_attribute(self, instance):
+        """Use the whole post, the HTML is stored alongside markdown."""
+        return instance
+
+    def to_representation(self, value):
+        """Object instance to dict of primitive datatypes."""
+        return value.content_html or markdownify(value.content)
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """URLs of resized variants of an image.
+
+    Variants are rendered in background, clients should fall back to the
+    original image when a variant is not there yet.
+    """
 
     def to_representation(self, value):
         """Object instance to dict of primitive datatypes."""
-        return markdownify(value)
+        if not value:
+            return None
+        request = self.context.get('request', None)
+        urls = {
+            variant: value.storage.url(variant_name(value.name, variant))
+            for variant in settings.IMAGE_VARIANTS
+        }
+        return {
+            variant: request.build_absolute_uri(url) if request else url
+            for variant, url in urls.items()
+        }
+
+
+class UploadedFileField(serializers.FileField):
+    """File field taking name of a file already uploaded to media/tmp."""
+
+    def to_internal_value(self, data):
+        """Primitive datatype to native value."""
+        if not isinstance(data, str) or not temporary_path(data).is_file():
+            raise serializers.ValidationError(
+                'Nie znaleziono przesłanego pliku.'
+            )
+        return data
+
+
+class UseUploadedFilesMixin(object):
+    """Move files uploaded to media/tmp into place on save."""
+
+    uploaded_fields = ()
+
+    def _move_uploaded(self, validated_data):
+        for field in self.uploaded_fields:
+            if field in validated_data:
+                validated_data[field] = move_uploaded(
+                    validated_data[field],
+                    self.Meta.model._meta.get_field(field)
+                )
+        return validated_data
+
+    def create(self, validated_data):
+        """Create instance."""
+        return super().create(self._move_uploaded(validated_data))
+
+    def update(self, instance, validated_data):
+        """Update instance."""
+        return super().update(instance, self._move_uploaded(validated_data))
+
+
+class SparseFieldsMixin(object):
+    """Emit only `fields` of the context, plus `expand` relations.
+
+    Both are sets of field names picked by the view, nested serializers
+    are left whole.
+    """
+
+    expandable_fields = {}
+
+    def get_fields(self):
+        """Fields of serializer instance."""
+        fields = super().get_fields()
+        parent = self.parent.parent\
+            if isinstance(self.parent, serializers.ListSerializer)\
+            else self.parent
+        if parent is not None:
+            return fields
+        expand = self.context.get('expand') or ()
+        for name in expand:
+            fields[name] = copy.deepcopy(self.expandable_fields[name])
+        selected = self.context.get('fields')
+        if selected:
+            for name in list(fields):
+                if name not in selected and name not in expand:
+                    del fields[name]
+        return fields
 
 
 class AttachmentsSerializer(serializers.ModelSerializer):
@@ -29,9 +121,25 @@ class AttachmentsSerializer(serializers.ModelSerializer):
         model = Attachment
 
 
+class AttachmentsSerializerUseUploadedFile(UseUploadedFilesMixin,
+                                           AttachmentsSerializer):
+    """Attachments serializer for already uploaded file."""
+
+    file = UploadedFileField()
+    uploaded_fields = ('file', )
+
+
+class ChunkedUploadSerializer(serializers.Serializer):
+    """Chunked upload serializer."""
+
+    filename = serializers.CharField(max_length=100)
+
+
 class EntitiesSerializer(serializers.ModelSerializer):
     """Entities serializer."""
 
+    image_variants = ImageVariantsField(source='image')
+
     class Meta:
         """Meta."""
 
@@ -39,6 +147,14 @@ class EntitiesSerializer(serializers.ModelSerializer):
         model = Entity
 
 
+class EntitiesSerializerUseUploadedImage(UseUploadedFilesMixin,
+                                         EntitiesSerializer):
+    """Entities serializer for already uploaded image."""
+
+    image = UploadedFileField(allow_null=True, required=False)
+    uploaded_fields = ('image', )
+
+
 class EventDetailsSerializer(serializers.ModelSerializer):
     """EventDetails serializer."""
 
@@ -50,10 +166,45 @@ class EventDetailsSerializer(serializers.ModelSerializer):
         read_only_fields = ('post', )
 
 
+class EventsSerializerCalendar(serializers.ModelSerializer):
+    """Events calendar feed serializer."""
+
+    title = serializers.CharField(source='post.title')
+
+    class Meta:
+        """Meta."""
+
+        fields = ('post', 'title', 'start', 'end', 'place')
+        model = EventDetails
+
+
+class EventsSerializerICalendar(EventsSerializerCalendar):
+    """Events calendar feed serializer for iCalendar, times in UTC."""
+
+    start = serializers.DateTimeField(format='%Y%m%dT%H%M%SZ',
+                                      default_timezone=timezone.utc)
+    end = serializers.DateTimeField(format='%Y%m%dT%H%M%SZ',
+                                    default_timezone=timezone.utc)
+
+
+class EntityIdsField(serializers.ListField):
+    """Ids of entities in a participants group.
+
+    Ids are checked by PostsSerializer for all groups in one query.
+    """
+
+    child = serializers.IntegerField()
+
+    def get_attribute(self, instance):
+        """Ids of (prefetched) entities."""
+        return [entity.id for entity in instance.entities.all()]
+
+
 class EventParticipantsSerializer(serializers.ModelSerializer):
     """EventParticipants serializer."""
 
     id = serializers.IntegerField(required=False)
+    entities = EntityIdsField(required=False)
 
     class Meta:
         """Meta."""
@@ -63,7 +214,7 @@ class EventParticipantsSerializer(serializers.ModelSerializer):
         read_only_fields = ('post', )
 
 
-class PostsSerializer(serializers.ModelSerializer):
+class PostsSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Posts serializer for administration panel."""
 
     attachment_set = AttachmentsSerializer(many=True,
@@ -72,13 +223,42 @@ class PostsSerializer(serializers.ModelSerializer):
                                           required=False)
     eventparticipants_set = EventParticipantsSerializer(many=True,
                                                         required=False)
+    header_variants = ImageVariantsField(source='header')
 
     class Meta:
         """Meta."""
 
-        fields = ('__all__')
+        exclude = ('content_html', 'search_vector')
         model = Post
 
+    def to_representation(self, instance):
+        """Object instance to dict of primitive datatypes."""
+        if 'eventparticipants_set' in self.fields\
+                and 'eventparticipants_set' not in getattr(
+                    instance, '_prefetched_objects_cache', {}):
+            # just written, load related rows in constant queries
+            prefetch_related_objects([instance],
+                                     'attachment_set',
+                                     'eventparticipants_set__entities')
+        return super().to_representation(instance)
+
+    def validate_eventparticipants_set(self, value):
+        """Check groups belong to the post, have labels and known entities."""
+        ids = {ep['id'] for ep in value if 'id' in ep}
+        if ids and (self.instance is None or len(ids) != self.instance
+                    .eventparticipants_set.filter(id__in=ids).count()):
+            raise serializers.ValidationError('Nieznana grupa uczestników.')
+        if any('id' not in ep and 'label' not in ep for ep in value):
+            # partial updates do not require it
+            raise serializers.ValidationError(
+                'Nowa grupa uczestników wymaga etykiety.'
+            )
+        ids = {id for ep in value for id in ep.get('entities', [])}
+        if ids and len(ids) != Entity.objects.filter(id__in=ids).count():
+            raise serializers.ValidationError('Nieznany podmiot.')
+        return value
+
+    @transaction.atomic
     def create(self, validated_data):
         """Create instance."""
         eventdetails = validated_data\
@@ -86,18 +266,14 @@ class PostsSerializer(serializers.ModelSerializer):
         eventparticipants_set = validated_data\
             .pop('eventparticipants_set', [])
         post_instance = Post.objects.create(**validated_data)
-        try:
+        if {'start', 'end'}.issubset(eventdetails):
             EventDetails.objects.create(post=post_instance,
                                         **eventdetails)
-        except IntegrityError:
-            pass  # seems there is no eventdetails
-        for eventparticipants in eventparticipants_set:
-            entities = eventparticipants.pop('entities')
-            ep = EventParticipants.objects.create(post=post_instance,
-                                                  **eventparticipants)
-            ep.entities.add(*entities)
+        self._write_eventparticipants(post_instance, {},
+                                      eventparticipants_set)
         return post_instance
 
+    @transaction.atomic
     def update(self, post_instance, validated_data):
         """Update instance."""
         eventdetails = validated_data\
@@ -116,11 +292,9 @@ class PostsSerializer(serializers.ModelSerializer):
         try:
             eventdetails_instance = post_instance.eventdetails
         except EventDetails.DoesNotExist:
-            try:
+            if {'start', 'end'}.issubset(eventdetails):
                 EventDetails.objects.create(post=post_instance,
                                             **eventdetails)
-            except IntegrityError:
-                pass  # seems there is no eventdetails
         else:
             eventdetails_instance.start = eventdetails\
                 .get('start', eventdetails_instance.start)
@@ -129,31 +303,54 @@ class PostsSerializer(serializers.ModelSerializer):
             eventdetails_instance.place = eventdetails\
                 .get('place', eventdetails_instance.place)
             eventdetails_instance.save()
+        existing = {
+            ep.id: ep for ep in post_instance.eventparticipants_set.all()
+        }
+        ids = {ep['id'] for ep in eventparticipants_set if 'id' in ep}
         # deleted eventparticipants
-        for id in set(
-            post_instance.eventparticipants_set.values_list('id',
-                                                            flat=True)
-        ).difference([
-            ep['id'] for ep in eventparticipants_set if 'id' in ep.keys()
-        ]):
-            EventParticipants.objects.filter(id=id).delete()
-        # added / updated eventparticipants
-        for ep in eventparticipants_set:  # ep stands for eventparticipants
-            entities = ep.pop('entities', [])
-            try:
-                ep_instance = EventParticipants.objects.get(id=ep['id'])
-            except KeyError:  # new entry - create
-                ep_instance = EventParticipants\
-                    .objects\
-                    .create(post=post_instance, **ep)
-                ep_instance.entities.add(*entities)
-            else:  # change entry
-                ep_instance.label = ep.get('label',
-                                           ep_instance.label)
-                ep_instance.entities.set(entities)
-                ep_instance.save()
+        if set(existing).difference(ids):
+            EventParticipants.objects\
+                .filter(id__in=set(existing).difference(ids))\
+                .delete()
+        self._write_eventparticipants(post_instance, existing,
+                                      eventparticipants_set)
         return post_instance
 
+    def _write_eventparticipants(self, post_instance, existing,
+                                 eventparticipants_set):
+        # added / updated eventparticipants, entities diffed in one pass
+        changed, added, rows = [], [], []
+        for ep in eventparticipants_set:  # ep stands for eventparticipants
+            if 'id' in ep:  # change entry
+                ep_instance = existing[ep['id']]
+                ep_instance.label = ep.get('label', ep_instance.label)
+                changed.append(ep_instance)
+            else:  # new entry - create
+                ep_instance = EventParticipants(post=post_instance,
+                                                label=ep['label'])
+                added.append(ep_instance)
+            rows.append((ep_instance, ep.get('entities', [])))
+        if changed:
+            EventParticipants.objects.bulk_update(changed, ('label', ))
+        bulk_create(EventParticipants, added)
+        through = EventParticipants.entities.through
+        wanted = {(ep_instance.id, entity_id)
+                  for ep_instance, entities in rows
+                  for entity_id in entities}
+        current = {
+            (ep_id, entity_id): id
+            for id, ep_id, entity_id in through.objects
+            .filter(eventparticipants__in=changed)
+            .values_list('id', 'eventparticipants_id', 'entity_id')
+        } if changed else {}
+        stale = [id for row, id in current.items() if row not in wanted]
+        if stale:
+            through.objects.filter(id__in=stale).delete()
+        through.objects.bulk_create([
+            through(eventparticipants_id=ep_id, entity_id=entity_id)
+            for ep_id, entity_id in wanted.difference(current)
+        ])
+
 
 class PostsSerializerMarkdownifyContent(PostsSerializer):
     """Posts serializer for client."""
@@ -161,49 +358,68 @@ class PostsSerializerMarkdownifyContent(PostsSerializer):
     content = MarkdownField(read_only=True)
 
 
-class PostsSerializerUseUploadedHeader(PostsSerializer):
+class PostsSerializerUseUploadedHeader(UseUploadedFilesMixin,
+                                       PostsSerializer):
     """Posts serializer for already uploaded header."""
 
-    header = serializers.CharField()
-
-    def _to_inmemoryuploadedfile(self, validated_data):
-        with open((Path(settings.MEDIA_ROOT)
-                   / 'tmp'
-                   / validated_data['header']).as_posix(),
-                  'rb') as image:
-            uploaded_image = InMemoryUploadedFile(
-                file=io.BytesIO(image.read()),
-                field_name=None,
-                name=validated_data['header'],
-                content_type=mimetypes.guess_type(validated_data['header']),
-                size=image.tell(),
-                charset=None
-            )
-            validated_data.update({
-                    'header': uploaded_image,
-            })
-        Path(image.name).unlink()
-        return validated_data
-
-    def create(self, validated_data):
-        """Create instance."""
-        return super(self.__class__, self)\
-            .create(self._to_inmemoryuploadedfile(validated_data))
-
-    def update(self, post_instance, validated_data):
-        """Update instance."""
-        return super(self.__class__, self)\
-            .update(post_instance,
-                    self._to_inmemoryuploadedfile(validated_data))
+    header = UploadedFileField()
+    uploaded_fields = ('header', )
 
 
-class PostsSerializerList(serializers.ModelSerializer):
+class PostsSerializerList(SparseFieldsMixin, serializers.ModelSerializer):
     """Posts /list/ serializer for client and administration panel."""
 
+    expandable_fields = {
+        'attachment_set': AttachmentsSerializer(many=True, read_only=True),
+        'eventparticipants_set': EventParticipantsSerializer(
+            many=True, read_only=True
+        ),
+    }
+    attachment_count = serializers.SerializerMethodField()
+    header_variants = ImageVariantsField(source='header')
+    participant_labels = serializers.SerializerMethodField()
+
     class Meta:
         """Meta."""
 
         depth = 1
-        fields = ('id', 'title', 'header', 'slider', 'created', 'updated',
-                  'eventdetails')
+        fields = ('id', 'title', 'header', 'header_variants', 'slider',
+                  'created', 'updated', 'eventdetails', 'attachment_count',
+                  'participant_labels')
+        model = Post
+
+    def get_attachment_count(self, instance):
+        """Number of attachments, prefetched."""
+        return len(instance.attachment_set.all())
+
+    def get_participant_labels(self, instance):
+        """Labels of participant groups, prefetched."""
+        return [ep.label for ep in instance.eventparticipants_set.all()]
+
+
+class PostFeedSerializer(serializers.BaseSerializer):
+    """Posts /list/ payload precomputed by feed.py."""
+
+    def to_representation(self, instance):
+        """Stored payload with absolute media URLs."""
+        data = json.loads(instance.payload)
+        request = self.context.get('request', None)
+        if request is not None and data['header']:
+            data['header'] = request.build_absolute_uri(data['header'])
+            data['header_variants'] = {
+                variant: request.build_absolute_uri(url)
+                for variant, url in data['header_variants'].items()
+            }
+        return data
+
+
+class PostsSerializerSlider(serializers.ModelSerializer):
+    """Posts /slider/ serializer for client."""
+
+    header_variants = ImageVariantsField(source='header')
+
+    class Meta:
+        """Meta."""
+
+        fields = ('id', 'title', 'header', 'header_variants')
         model = Post
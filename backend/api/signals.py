@@ -0,0 +1,190 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed,
+                                      post_delete,
+                                      post_save,
+                                      pre_delete)
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from . import feed
+from .caching import invalidate
+from .media import REFERENCES, release
+from .models import Attachment, Entity, EventDetails, EventParticipants, Post
+from .search import update_search_vector
+from .utils.compress import precompress_file
+from .utils.variants import build_variants
+
+
+# sent by bulk endpoints in place of per row post_save
+bulk_saved = Signal(providing_args=['instances'])
+
+# cached response namespaces depending on each model
+CACHE_DEPENDENCIES = {
+    Attachment: ('attachments', 'posts'),
+    Entity: ('entities', 'posts'),
+    EventDetails: ('posts', ),
+    EventParticipants: ('posts', ),
+    Post: ('posts', ),
+}
+
+
+def post_ids(instance):
+    """Ids of posts owning related row `instance`, before and after a move."""
+    return {instance.post_id,
+            getattr(instance, '_stored_post_id', instance.post_id)}
+
+
+def touch_post(sender, instance, **kwargs):
+    """Bump `updated` of the posts owning a changed related row."""
+    Post.objects.filter(id__in=post_ids(instance))\
+        .update(updated=timezone.now())
+
+
+for model in (Attachment, EventDetails, EventParticipants):
+    post_save.connect(touch_post, sender=model)
+    post_delete.connect(touch_post, sender=model)
+
+
+@receiver(bulk_saved, sender=Attachment)
+def touch_posts(sender, instances, **kwargs):
+    """Bump `updated` of posts owning rows saved in bulk."""
+    Post.objects.filter(id__in={id for instance in instances
+                                for id in post_ids(instance)})\
+        .update(updated=timezone.now())
+
+
+@receiver(m2m_changed, sender=EventParticipants.entities.through)
+def touch_post_entities(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    """Bump `updated` of posts whose participant entities changed."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        touch_post(sender, instance)
+    elif pk_set:
+        Post.objects.filter(eventparticipants__id__in=pk_set)\
+            .update(updated=timezone.now())
+
+
+@receiver(pre_delete, sender=Entity)
+def touch_posts_entity(sender, instance, **kwargs):
+    """Bump `updated` of posts whose participants include deleted entity.
+
+    Its through rows are deleted without m2m_changed.
+    """
+    ids = list(Post.objects.filter(eventparticipants__entities=instance)
+               .values_list('id', flat=True).distinct())
+    if ids:
+        Post.objects.filter(id__in=ids).update(updated=timezone.now())
+        feed.changed(ids)
+
+
+def invalidate_cache(sender, **kwargs):
+    """Drop cached responses depending on a changed model."""
+    invalidate(*CACHE_DEPENDENCIES[sender])
+
+
+for model in CACHE_DEPENDENCIES:
+    post_save.connect(invalidate_cache, sender=model)
+    post_delete.connect(invalidate_cache, sender=model)
+    bulk_saved.connect(invalidate_cache, sender=model)
+
+
+@receiver(m2m_changed, sender=EventParticipants.entities.through)
+def invalidate_cache_entities(sender, action, **kwargs):
+    """Drop cached posts when participant entities change."""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate('posts')
+
+
+@receiver(post_delete, sender=Token)
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def revoke_cached_tokens(sender, update_fields=None, **kwargs):
+    """Drop cached tokens on logout and user changes, deactivation too."""
+    if update_fields == frozenset(['last_login']):
+        # every login, nothing cached changes
+        return
+    invalidate('tokens')
+
+
+@receiver(post_save, sender=Entity)
+@receiver(post_save, sender=Post)
+def build_image_variants(sender, instance, **kwargs):
+    """Render variants of saved post header or entity image."""
+    image = instance.header if sender is Post else instance.image
+    if image:
+        transaction.on_commit(lambda: build_variants(image))
+
+
+@receiver(bulk_saved, sender=Entity)
+def build_image_variants_bulk(sender, instances, **kwargs):
+    """Render variants of entity images saved in bulk."""
+    for instance in instances:
+        build_image_variants(sender, instance)
+
+
+@receiver(post_save, sender=Attachment)
+def precompress_attachment(sender, instance, **kwargs):
+    """Write compressed siblings of saved attachment file."""
+    file = instance.file
+    transaction.on_commit(lambda: precompress_file(file))
+
+
+@receiver(bulk_saved, sender=Attachment)
+def precompress_attachments_bulk(sender, instances, **kwargs):
+    """Write compressed siblings of attachment files saved in bulk."""
+    for instance in instances:
+        precompress_attachment(sender, instance)
+
+
+def release_file(sender, instance, **kwargs):
+    """Delete file of deleted row once nothing else references it."""
+    name = getattr(instance, dict(REFERENCES)[sender]).name
+    if name:
+        transaction.on_commit(lambda: release(name))
+
+
+for model, _ in REFERENCES:
+    post_delete.connect(release_file, sender=model)
+
+
+@receiver(post_save, sender=Post)
+def update_post_search_vector(sender, instance, **kwargs):
+    """Recompute search vector of saved post."""
+    update_search_vector(Post.objects.filter(id=instance.id))
+
+
+def refresh_feed(sender, instance, **kwargs):
+    """Recompute feed row of a changed post."""
+    feed.changed([instance.id] if sender is Post else post_ids(instance))
+
+
+post_save.connect(refresh_feed, sender=Post)
+post_delete.connect(refresh_feed, sender=Post)
+for model in (Attachment, EventDetails, EventParticipants):
+    # after touch_post, the feed copies `updated`
+    post_save.connect(refresh_feed, sender=model)
+    post_delete.connect(refresh_feed, sender=model)
+
+
+@receiver(bulk_saved, sender=Attachment)
+def refresh_feed_bulk(sender, instances, **kwargs):
+    """Recompute feed rows of posts owning rows saved in bulk."""
+    feed.changed({id for instance in instances
+                  for id in post_ids(instance)})
+
+
+@receiver(m2m_changed, sender=EventParticipants.entities.through)
+def refresh_feed_entities(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    """Recompute feed rows of posts touched by participant entity changes."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        feed.changed([instance.post_id])
+    elif pk_set:
+        feed.changed(Post.objects.filter(eventparticipants__id__in=pk_set)
+                     .values_list('id', flat=True))
@@ -0,0 +1,90 @@
+from pathlib import Path
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.storage import FileSystemStorage
+
+from .utils.compress import is_compressible, precompress
+
+
+def content_name(digest, name):
+    """Content-addressed storage name of file `name` hashed to `digest`."""
+    return 'cas/{}/{}{}'.format(digest[:2], digest, Path(name).suffix.lower())
+
+
+class MediaStorage(FileSystemStorage):
+    """Model field uploads, content-addressed if MEDIA_CONTENT_ADDRESSED is on.
+
+    Content-addressed files are named by SHA-256 of their content, hashed
+    while written, so identical uploads are stored once. Other files, like
+    markdownx images, go to the default storage keeping their names.
+    """
+
+    def _save(self, name, content):
+        if not settings.MEDIA_CONTENT_ADDRESSED:
+            return super()._save(name, content)
+        directory = Path(self.path('cas'))
+        directory.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, partial = tempfile.mkstemp(suffix='.part',
+                                       dir=directory.as_posix())
+        try:
+            with os.fdopen(fd, 'wb') as destination:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    destination.write(chunk)
+            return self._adopt(partial, digest.hexdigest(), name)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def move_into(self, path, name):
+        """Move local file at `path` into storage, returns stored name.
+
+        The file is renamed, not copied. Content-addressed, `name` gives
+        the extension only and an already stored copy is reused.
+        """
+        if not settings.MEDIA_CONTENT_ADDRESSED:
+            destination = Path(self.path(name))
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(str(path), destination.as_posix())
+            return name
+        digest = hashlib.sha256()
+        with open(str(path), 'rb') as source:
+            for chunk in iter(lambda: source.read(64 * 1024), b''):
+                digest.update(chunk)
+        return self._adopt(str(path), digest.hexdigest(), name)
+
+    def _adopt(self, path, digest, name):
+        stored = content_name(digest, name)
+        destination = Path(self.path(stored))
+        if destination.exists():
+            os.remove(path)
+            # fresh mtime keeps the reused copy from garbage collection
+            os.utime(destination.as_posix())
+        else:
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            os.chmod(path, self.file_permissions_mode or 0o644)
+            os.replace(path, destination.as_posix())
+        return stored
+
+
+upload_storage = MediaStorage()
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Content-hashed static files with precompressed siblings."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        """Hash files, then precompress originals and hashed copies."""
+        for name, hashed_name, processed in super().post_process(
+                paths, dry_run, **options):
+            if not dry_run and hashed_name\
+                    and not isinstance(processed, Exception)\
+                    and is_compressible(name):
+                for stored in {name, hashed_name}:
+                    precompress(Path(self.path(stored)))
+            yield name, hashed_name, processed
@@ -1,3 +1,1266 @@
-from django.test import TestCase
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+import base64
+import gzip
+import hashlib
+import os
+import tempfile
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import feed
+from .db import check_connections, mark_idle
+from .metrics import registry
+from .storage import CompressedManifestStaticFilesStorage, upload_storage
+from .utils.compress import precompress, precompress_file
+from .utils.uploads import temporary_path
+from .utils.variants import build_variants, variant_name
+from .models import (Attachment,
+                     Entity,
+                     EventDetails,
+                     EventParticipants,
+                     Post,
+                     PostFeed)
+
+
+def create_event(title, participants=3, entities=()):
+    """Create post with event details, participants and attachments."""
+    post = Post.objects.create(title=title, content='# {}'.format(title))
+    EventDetails.objects.create(post=post,
+                                start=timezone.now(),
+                                end=timezone.now() + timedelta(hours=2))
+    for i in range(participants):
+        ep = EventParticipants.objects.create(post=post,
+                                              label='group {}'.format(i))
+        ep.entities.add(*entities)
+    for i in range(2):
+        Attachment.objects.create(post=post,
+                                  name='attachment {}'.format(i),
+                                  file='attachment{}.pdf'.format(i))
+    return post
+
+
+@contextmanager
+def committed():
+    """Run on_commit callbacks of writes in the block, as if committed.
+
+    TestCase never commits, Django 2.2 has no captureOnCommitCallbacks.
+    """
+    start = len(connection.run_on_commit)
+    yield
+    callbacks = connection.run_on_commit[start:]
+    del connection.run_on_commit[start:]
+    for _, callback in callbacks:
+        callback()
+
+
+class PostsQueryCountTestCase(TestCase):
+    """Posts endpoints run a constant number of queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.entities = [
+            Entity.objects.create(name='entity {}'.format(i),
+                                  url='http://example.com',
+                                  type=1)
+            for i in range(5)
+        ]
+        cls.posts = [create_event('event {}'.format(i),
+                                  entities=cls.entities)
+                     for i in range(10)]
+        Post.objects.create(title='post', content='content')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_list(self):
+        for only in ('', 'events', 'posts'):
+            # validators aggregate and the page itself
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/posts/',
+                                           {'only': only} if only else {})
+            self.assertEqual(response.status_code, 200)
+
+    def test_list_fields(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/posts/',
+                                       {'fields': 'id,title,header'})
+        self.assertEqual(set(response.data['results'][0]),
+                         {'id', 'title', 'header'})
+        self.assertNotIn('content', context.captured_queries[-1]['sql'])
+        self.assertNotIn('eventdetails', context.captured_queries[-1]['sql'])
+
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/posts/', {
+                'fields': 'id',
+                'expand': 'eventparticipants_set',
+            })
+        self.assertEqual(
+            len(response.data['results'][1]['eventparticipants_set']), 3
+        )
+
+        response = self.client.get('/api/posts/', {'fields': 'search_vector'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(SLIDER_SIZE=2)
+    def test_slider(self):
+        Post.objects.filter(id__in=[post.id for post in self.posts[:3]])\
+            .update(slider=True)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/posts/slider/')
+        self.assertEqual([post['id'] for post in response.data],
+                         [self.posts[2].id, self.posts[1].id])
+        with self.assertNumQueries(0):
+            self.client.get('/api/posts/slider/')
+
+    def test_detail(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                '/api/posts/{}/'.format(self.posts[0].id)
+            )
+        self.assertEqual(len(response.data['eventparticipants_set']), 3)
+        self.assertEqual(len(response.data['attachment_set']), 2)
+
+    def test_detail_markdownify(self):
+        with self.assertNumQueries(4):
+            self.client.get(
+                '/api/posts/{}/'.format(self.posts[0].id),
+                {'markdownify': ''}
+            )
+
+
+class CachedResponseTestCase(TestCase):
+    """Anonymous reads are cached until a model they depend on changes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin',
+                                                 'admin@example.com',
+                                                 'password')
+        cls.entity = Entity.objects.create(name='entity',
+                                           url='http://example.com',
+                                           type=1)
+        cls.post = create_event('event', entities=[cls.entity])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = '/api/posts/{}/'.format(self.post.id)
+
+    def assertCached(self, url):
+        """Second request of `url` runs no queries."""
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_hit(self):
+        for url in (self.url, '/api/posts/', '/api/entities/'):
+            self.assertCached(url)
+
+    def test_invalidation(self):
+        self.assertCached(self.url)
+        with committed():
+            Post.objects.filter(id=self.post.id).first().save()
+            # not committed yet, a read now must not outlive the commit
+            with self.assertNumQueries(0):
+                self.client.get(self.url)
+        with self.assertNumQueries(4):
+            self.client.get(self.url)
+
+        self.assertCached(self.url)
+        participants = self.post.eventparticipants_set.first()
+        participants.label = 'renamed'
+        with committed():
+            participants.save()
+        response = self.client.get(self.url)
+        self.assertIn('renamed', [ep['label'] for ep
+                                  in response.data['eventparticipants_set']])
+
+        self.assertCached(self.url)
+        self.assertCached('/api/entities/')
+        self.entity.name = 'renamed'
+        with committed():
+            self.entity.save()
+        self.assertEqual(self.client.get('/api/entities/').data[0]['name'],
+                         'renamed')
+        with self.assertNumQueries(4):
+            self.client.get(self.url)
+
+    def test_authenticated(self):
+        self.assertCached(self.url)
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(4):
+            self.client.get(self.url)
+
+
+class ConditionalGetTestCase(TestCase):
+    """Fresh client copies get 304 until the post or its relations change."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.entity = Entity.objects.create(name='entity',
+                                            url='http://example.com',
+                                            type=1)
+        self.post = create_event('event', entities=[self.entity])
+        self.url = '/api/posts/{}/'.format(self.post.id)
+
+    def assertNotModified(self, url, response):
+        """Validators of `response` still match `url`."""
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            .status_code, 304
+        )
+        self.assertEqual(
+            self.client.get(url,
+                            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            .status_code, 304
+        )
+
+    def test_detail(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotModified(self.url, response)
+
+    def test_list(self):
+        response = self.client.get('/api/posts/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotModified('/api/posts/', response)
+
+    def test_nested_change(self):
+        response = self.client.get(self.url)
+        with committed():
+            self.entity.delete()
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+            .status_code, 200
+        )
+
+        response = self.client.get(self.url)
+        participants = self.post.eventparticipants_set.first()
+        participants.label = 'renamed'
+        with committed():
+            participants.save()
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+            .status_code, 200
+        )
+
+
+class PostsUpdateTestCase(TestCase):
+    """Nested post update writes in a constant number of queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin',
+                                                 'admin@example.com',
+                                                 'password')
+        cls.entities = [
+            Entity.objects.create(name='entity {}'.format(i),
+                                  url='http://example.com',
+                                  type=1)
+            for i in range(10)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def update(self, participants):
+        """Update event with `participants` groups, return query count."""
+        post = create_event('event', participants=participants,
+                            entities=self.entities[:5])
+        groups = list(post.eventparticipants_set.all())
+        payload = {
+            'title': 'event',
+            'content': 'content',
+            'eventdetails': {
+                'start': '2021-07-01 10:00',
+                'end': '2021-07-01 12:00',
+                'place': 'place',
+            },
+            'eventparticipants_set': [
+                {
+                    'id': ep.id,
+                    'label': 'renamed {}'.format(ep.id),
+                    'entities': [e.id for e in self.entities[3:8]],
+                } for ep in groups[1:]
+            ] + [{'label': 'new', 'entities': [self.entities[0].id]}],
+        }
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.put('/api/posts/{}/'.format(post.id),
+                                       payload,
+                                       format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(post.eventparticipants_set.count(), participants)
+        for ep in post.eventparticipants_set.exclude(label='new'):
+            self.assertEqual(
+                set(ep.entities.values_list('id', flat=True)),
+                {e.id for e in self.entities[3:8]}
+            )
+        return len(context)
+
+    def test_update_large_event(self):
+        self.assertEqual(self.update(5), self.update(30))
+
+    def test_partial_update_new_group(self):
+        post = create_event('event', participants=1)
+        url = '/api/posts/{}/'.format(post.id)
+        response = self.client.patch(url, {
+            'eventparticipants_set': [{'entities': []}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('eventparticipants_set', response.data)
+
+        response = self.client.patch(url, {
+            'eventparticipants_set': [{'label': 'new', 'entities': []}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(post.eventparticipants_set.values_list('label', flat=True)),
+            ['new']
+        )
+
+    def test_unknown_group(self):
+        other = create_event('other', participants=1)
+        group = {'id': other.eventparticipants_set.get().id, 'label': 'copy'}
+        response = self.client.post('/api/posts/', {
+            'title': 'copy', 'content': 'content',
+            'eventparticipants_set': [group],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('eventparticipants_set', response.data)
+
+        post = create_event('event', participants=1)
+        response = self.client.patch('/api/posts/{}/'.format(post.id), {
+            'title': 'changed', 'eventparticipants_set': [group],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        post.refresh_from_db()
+        self.assertEqual(post.title, 'event')
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(other.eventparticipants_set.get().label, 'group 0')
+
+
+class EventsTestCase(TestCase):
+    """Events feed picks events by window, also as iCalendar."""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.events = {}
+        for name, start in (('old', now - timedelta(days=400)),
+                            ('past', now - timedelta(days=10)),
+                            ('ongoing', now - timedelta(hours=1)),
+                            ('upcoming', now + timedelta(days=10))):
+            post = Post.objects.create(title=name, content=name)
+            EventDetails.objects.create(post=post, start=start,
+                                        end=start + timedelta(hours=2))
+            cls.events[name] = post
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def titles(self, **params):
+        response = self.client.get('/api/posts/events/', params)
+        self.assertEqual(response.status_code, 200)
+        return [event['title'] for event in response.data]
+
+    def test_window(self):
+        self.assertEqual(self.titles(), ['past', 'ongoing', 'upcoming'])
+        old = self.events['old'].eventdetails.start.date()
+        self.assertEqual(self.titles(**{'from': old.isoformat(),
+                                        'to': old.isoformat()}), ['old'])
+        self.assertEqual(self.titles(**{'from': old.isoformat()}), ['old'])
+        self.assertEqual(self.titles(upcoming=''), ['upcoming'])
+        self.assertEqual(self.titles(ongoing=''), ['ongoing'])
+
+    def test_bad_date(self):
+        response = self.client.get('/api/posts/events/', {'from': 'jutro'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_icalendar(self):
+        post = self.events['upcoming']
+        post.title = 'Zawody; finał, dzień\\1 ' + 'ż' * 40
+        post.save()
+        details = post.eventdetails
+        details.start = datetime(2030, 6, 1, 12, tzinfo=timezone.utc)\
+            .astimezone(timezone.get_current_timezone())
+        details.end = details.start + timedelta(hours=2)
+        details.save()
+        response = self.client.get('/api/posts/events/', {
+            'format': 'ics', 'from': '2030-06-01', 'to': '2030-06-01'
+        })
+        self.assertEqual(response['Content-Type'],
+                         'text/calendar; charset=utf-8')
+        body = response.content.decode()
+        lines = body.split('\r\n')
+        self.assertTrue(all(len(line.encode()) <= 75 for line in lines))
+        self.assertIn('DTSTART:20300601T120000Z', lines)
+        self.assertIn('DTEND:20300601T140000Z', lines)
+        summary = body[body.index('SUMMARY:'):].split('\r\nEND:')[0]
+        self.assertEqual(summary.replace('\r\n ', ''),
+                         'SUMMARY:Zawody\\; finał\\, dzień\\\\1 '
+                         + 'ż' * 40)
+
+
+class PostsSearchTestCase(TestCase):
+    """Search ranks title matches above content matches."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.content = Post.objects.create(title='first',
+                                          content='zawody w piłce nożnej')
+        cls.title = Post.objects.create(title='Zawody',
+                                        content='piłka ręczna')
+        cls.both = Post.objects.create(title='zawody',
+                                       content='zawody w piłce nożnej')
+        Post.objects.create(title='other', content='nic')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def search(self, **params):
+        return self.client.get('/api/posts/search/', params)
+
+    def test_ranking(self):
+        response = self.search(q='zawody')
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([post['id'] for post in response.data['results']],
+                         [self.both.id, self.title.id, self.content.id])
+        response = self.search(q='zawody nożnej')
+        self.assertEqual([post['id'] for post in response.data['results']],
+                         [self.both.id, self.content.id])
+
+    def test_missing_query(self):
+        self.assertEqual(self.search().status_code, 400)
+        self.assertEqual(self.search(q=' ').status_code, 400)
+
+    def test_pagination_and_fields(self):
+        response = self.search(q='zawody', page_size=2, fields='id,title')
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title'})
+        self.assertIsNotNone(response.data['next'])
+        response = self.search(q='zawody', page_size=2, page=2)
+        self.assertEqual([post['id'] for post in response.data['results']],
+                         [self.content.id])
+
+
+class PostFeedTestCase(TestCase):
+    """Lists read from the feed match serialized posts."""
+
+    FIELDS = 'id,title,header,header_variants,slider,created,updated,'\
+        'eventdetails,attachment_count,participant_labels'
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_superuser('admin',
+                                                  'admin@example.com',
+                                                  'password')
+
+    def assertFeed(self):
+        """Feed list is the list serialized from posts."""
+        for only in ('', 'events', 'posts'):
+            params = {'only': only} if only else {}
+            self.assertEqual(
+                self.client.get('/api/posts/', params).json(),
+                self.client.get('/api/posts/',
+                                dict(params, fields=self.FIELDS)).json()
+            )
+
+    def test_feed(self):
+        post = create_event('event')
+        Post.objects.create(title='post', content='content',
+                            header='header.png')
+        self.assertFeed()
+        results = self.client.get('/api/posts/').data['results']
+        self.assertEqual(results[0]['header'],
+                         'http://testserver/media/header.png')
+        self.assertEqual(results[1]['attachment_count'], 2)
+        self.assertEqual(results[1]['participant_labels'],
+                         ['group 0', 'group 1', 'group 2'])
+
+        self.client.force_authenticate(self.user)
+        participants = post.eventparticipants_set.order_by('id')
+        response = self.client.patch(
+            '/api/posts/{}/'.format(post.id),
+            {'eventparticipants_set': [
+                {'id': participants[0].id, 'label': 'renamed'}
+            ]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        post.attachment_set.first().delete()
+        self.assertFeed()
+        self.assertEqual(
+            self.client.get('/api/posts/').data['results'][1]
+            ['participant_labels'], ['renamed']
+        )
+
+        self.client.delete('/api/posts/{}/'.format(post.id))
+        self.assertEqual(PostFeed.objects.count(), 1)
+        self.assertFeed()
+
+    def test_moved_attachment(self):
+        source, target = create_event('source'), create_event('target')
+        updated = source.updated
+        first, second = source.attachment_set.order_by('id')
+        self.client.force_authenticate(self.user)
+        response = self.client.patch(
+            '/api/attachments/{}/'.format(first.id), {'post': target.id},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch('/api/attachments/bulk/', [
+            {'id': second.id, 'post': target.id}
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {post['title']: post['attachment_count'] for post
+             in self.client.get('/api/posts/').data['results']},
+            {'source': 0, 'target': 4}
+        )
+        self.assertFeed()
+        source.refresh_from_db()
+        self.assertGreater(source.updated, updated)
+
+
+@override_settings(IMAGE_VARIANTS_ASYNC=False, MEDIA_ROOT=tempfile.mkdtemp())
+class ImageVariantsTestCase(TestCase):
+    """Images get resized WEBP variants, listed by the serializers."""
+
+    def setUp(self):
+        cache.clear()
+        output = BytesIO()
+        Image.new('RGBA', (800, 600), 'red').save(output, 'PNG')
+        self.entity = Entity(name='entity', url='http://example.com',
+                             type=1)
+        self.entity.image.save('logo.png', ContentFile(output.getvalue()))
+
+    def test_build(self):
+        build_variants(self.entity.image)
+        sizes = {}
+        for variant in settings.IMAGE_VARIANTS:
+            with Image.open(upload_storage.path(
+                    variant_name(self.entity.image.name, variant))) as image:
+                self.assertEqual(image.format, 'WEBP')
+                sizes[variant] = image.size
+        self.assertEqual(sizes, {'thumbnail': (320, 240),
+                                 'slider': (800, 600),
+                                 'full': (800, 600)})
+
+    def test_urls(self):
+        stem = Path(self.entity.image.name).stem
+        self.assertEqual(
+            self.client.get('/api/entities/').data[0]['image_variants'],
+            {variant: 'http://testserver/media/variants/{}/{}.webp'
+             .format(variant, stem) for variant in settings.IMAGE_VARIANTS}
+        )
+
+
+class MarkdownTestCase(TestCase):
+    """Stored HTML follows content, rendered only when it changes."""
+
+    def test_save(self):
+        post = Post.objects.create(title='post', content='# title')
+        self.assertEqual(post.content_html, '<h1>title</h1>')
+        post = Post.objects.get(id=post.id)
+        with mock.patch('backend.api.models.markdownify',
+                        return_value='<p>html</p>') as markdownify:
+            post.title = 'renamed'
+            post.save()
+            markdownify.assert_not_called()
+            post.content = '**bold**'
+            post.save(update_fields=['content'])
+            markdownify.assert_called_once_with('**bold**')
+        post.content = '*em*'
+        post.save(update_fields=['content'])
+        self.assertEqual(Post.objects.get(id=post.id).content_html,
+                         '<p><em>em</em></p>')
+
+    def test_command(self):
+        post = Post.objects.create(title='post', content='# title')
+        other = Post.objects.create(title='other', content='# other')
+        Post.objects.filter(id=post.id).update(content_html='')
+        updated = Post.objects.get(id=post.id).updated
+        output = StringIO()
+        call_command('markdownify_posts', chunk_size=1, stdout=output)
+        self.assertIn('Rendered 1 post(s).', output.getvalue())
+        post = Post.objects.get(id=post.id)
+        self.assertEqual(post.content_html, '<h1>title</h1>')
+        self.assertEqual(post.updated, updated)
+        self.assertEqual(Post.objects.get(id=other.id).content_html,
+                         '<h1>other</h1>')
+
+
+class PostsPaginationTestCase(TestCase):
+    """Posts list pages by cursor, newest first."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Post.objects.bulk_create([
+            Post(title='post {}'.format(i), content='content')
+            for i in range(120)
+        ])
+        now = timezone.now()
+        EventDetails.objects.bulk_create([
+            EventDetails(post_id=id, start=now, end=now)
+            for id in Post.objects.order_by('id')
+            .values_list('id', flat=True)[::4]
+        ])
+        feed.rebuild(500)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def walk(self, url):
+        """Ids of all pages following next links, and the responses."""
+        ids, responses = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [post['id'] for post in response.data['results']]
+            responses.append(response)
+            url = response.data['next']
+        return ids, responses
+
+    def test_pages(self):
+        ids, responses = self.walk('/api/posts/?page_size=50')
+        self.assertEqual(ids, list(Post.objects.order_by('-id')
+                                   .values_list('id', flat=True)))
+        self.assertEqual([len(response.data['results'])
+                          for response in responses], [50, 50, 20])
+        self.assertIsNone(responses[0].data['previous'])
+
+        # links do not move when posts are added
+        Post.objects.create(title='new', content='content')
+        cache.clear()
+        second = self.client.get(responses[0].data['next'])
+        self.assertEqual(second.data, responses[1].data)
+        previous = self.client.get(responses[2].data['previous'])
+        self.assertEqual(previous.data['results'],
+                         responses[1].data['results'])
+
+    def test_only(self):
+        ids, responses = self.walk('/api/posts/?only=events&page_size=10')
+        self.assertEqual(len(ids), 30)
+        self.assertEqual(set(ids), set(
+            EventDetails.objects.values_list('post_id', flat=True)
+        ))
+        for response in responses[:-1]:
+            self.assertIn('only=events', response.data['next'])
+
+    def test_page_size(self):
+        response = self.client.get('/api/posts/', {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 100)
+        response = self.client.get('/api/posts/')
+        self.assertEqual(len(response.data['results']), 20)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ChunkedUploadTestCase(TestCase):
+    """Uploads resume at the stored offset and end up as attachments."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user('admin', 'admin@example.com', 'password')
+        )
+        response = self.client.post('/api/upload/chunked/',
+                                    {'filename': 'document.pdf'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['offset'], 0)
+        self.name = response.data['name']
+        self.url = '/api/upload/chunked/{}/'.format(self.name)
+
+    def patch(self, chunk, offset, **headers):
+        return self.client.generic('PATCH', self.url, chunk,
+                                   'application/octet-stream',
+                                   HTTP_UPLOAD_OFFSET=str(offset), **headers)
+
+    def test_upload(self):
+        response = self.patch(b'0123', 0)
+        self.assertEqual(response.data['offset'], 4)
+
+        response = self.patch(b'4567', 2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 4)
+
+        response = self.patch(b'4567', 4, HTTP_CONTENT_MD5=base64.b64encode(
+            hashlib.md5(b'other').digest()
+        ).decode())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(self.url).data['offset'], 4)
+
+        response = self.patch(b'4567', 4, HTTP_CONTENT_MD5=base64.b64encode(
+            hashlib.md5(b'4567').digest()
+        ).decode())
+        self.assertEqual(response.data['offset'], 8)
+        self.assertEqual(self.client.get(self.url).data['offset'], 8)
+
+        post = Post.objects.create(title='post', content='content')
+        response = self.client.post('/api/attachments/', {
+            'post': post.id, 'name': 'document', 'file': self.name
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        name = Attachment.objects.get(id=response.data['id']).file.name
+        self.assertRegex(name, r'^[0-9a-f-]{36}\.pdf$')
+        self.assertNotEqual(name, self.name)
+        self.assertEqual(default_storage.open(name).read(), b'01234567')
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_list_body(self):
+        response = self.client.post('/api/attachments/', [{'name': 'a'}],
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(MEDIA_UPLOAD_MAX_SIZE=6)
+    def test_too_large(self):
+        self.assertEqual(self.patch(b'0123', 0).status_code, 200)
+        response = self.patch(b'4567', 4)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.client.get(self.url).data['offset'], 4)
+        self.assertEqual(self.patch(b'45', 4).data['offset'], 6)
+
+    def test_expired(self):
+        self.patch(b'0123', 0)
+        call_command('collect_media_garbage', stdout=StringIO())
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        call_command('collect_media_garbage', grace=0, stdout=StringIO())
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class EntitiesBulkTestCase(TestCase):
+    """Bulk endpoint writes all entities or none of them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin',
+                                                 'admin@example.com',
+                                                 'password')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk(self):
+        response = self.client.post('/api/entities/bulk/', [
+            {'name': 'entity {}'.format(i), 'url': 'http://example.com',
+             'type': 1} for i in range(20)
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        ids = [entity['id'] for entity in response.data]
+
+        with self.assertNumQueries(4):
+            response = self.client.patch('/api/entities/bulk/', [
+                {'id': pk, 'type': 2} for pk in ids
+            ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Entity.objects.filter(type=2).count(), 20)
+
+        response = self.client.patch('/api/entities/bulk/', [
+            {'id': ids[0], 'type': 1}, {'id': ids[1], 'type': 77}
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual(Entity.objects.filter(type=2).count(), 20)
+
+        response = self.client.delete('/api/entities/bulk/', ids[:10],
+                                      format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Entity.objects.count(), 10)
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': tempfile.mkdtemp(),
+}})
+class CachedTokenTestCase(TestCase):
+    """Known tokens skip the database until revoked."""
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user('admin', 'admin@example.com', 'password')
+        self.client = APIClient()
+        response = self.client.post('/api/auth/token/login/', {
+            'username': 'admin', 'password': 'password'
+        })
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + response.data['auth_token']
+        )
+
+    def get(self):
+        return self.client.get('/api/upload/chunked/missing/').status_code
+
+    def test_cached(self):
+        self.assertEqual(self.get(), 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(), 404)
+
+    def test_logout(self):
+        self.assertEqual(self.get(), 404)
+        with committed():
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get(), 401)
+
+    def test_deactivate(self):
+        self.assertEqual(self.get(), 404)
+        User.objects.filter(username='admin').update(is_active=False)
+        self.assertEqual(self.get(), 404)
+        user = User.objects.get(username='admin')
+        with committed():
+            user.save()
+        self.assertEqual(self.get(), 401)
+
+    def test_revoked_elsewhere(self):
+        self.assertEqual(self.get(), 404)
+        # another worker logs out through its own view of the cache
+        other = FileBasedCache(settings.CACHES['default']['LOCATION'], {})
+        with mock.patch('backend.api.caching.cache', other), committed():
+            Token.objects.all().delete()
+        self.assertEqual(self.get(), 401)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }})
+    def test_unshared(self):
+        self.assertEqual(self.get(), 404)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(), 404)
+
+
+class EntitiesDirectoryTestCase(TestCase):
+    """Directory lists all entities grouped by type."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        for name, type in (('b', 1), ('a', 1), ('c', 2)):
+            Entity.objects.create(name=name, url='http://example.com',
+                                  type=type)
+
+    def test_directory(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/entities/directory/')
+        self.assertEqual(list(response.data), ['member', 'other'])
+        self.assertEqual([e['name'] for e in response.data['member']],
+                         ['a', 'b'])
+        self.assertEqual([e['name'] for e in response.data['other']], ['c'])
+        with self.assertNumQueries(0):
+            self.client.get('/api/entities/directory/')
+
+        with committed():
+            Entity.objects.create(name='d', url='http://example.com', type=2)
+        response = self.client.get('/api/entities/directory/')
+        self.assertEqual(len(response.data['other']), 2)
+
+    def test_type(self):
+        response = self.client.get('/api/entities/', {'type': 'Member'})
+        self.assertEqual([e['name'] for e in response.data], ['a', 'b'])
+        response = self.client.get('/api/entities/', {'type': 'unknown'})
+        self.assertEqual(len(response.data), 3)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AttachmentsBulkTestCase(TestCase):
+    """Bulk attachments take uploaded files and bump their posts."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user('admin', 'admin@example.com', 'password')
+        )
+
+    def test_bulk(self):
+        post = Post.objects.create(title='post', content='content')
+        updated = post.updated
+        names = []
+        for i in range(3):
+            path = temporary_path('upload{}.pdf'.format(i))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes('content {}'.format(i).encode())
+            names.append(path.name)
+        response = self.client.post('/api/attachments/bulk/', [
+            {'post': post.id, 'name': name, 'file': name} for name in names
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        for i, attachment in enumerate(post.attachment_set.order_by('id')):
+            self.assertNotIn(attachment.file.name, names)
+            self.assertEqual(attachment.file.read(),
+                             'content {}'.format(i).encode())
+            self.assertFalse(temporary_path(names[i]).exists())
+        post.refresh_from_db()
+        self.assertGreater(post.updated, updated)
+
+        response = self.client.post('/api/attachments/bulk/', [
+            {'post': post.id, 'name': 'missing', 'file': 'missing.pdf'}
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(post.attachment_set.count(), 3)
+
+    def test_list_body(self):
+        response = self.client.post('/api/entities/', [{'name': 'a'}],
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(API_METRICS=True)
+class MetricsTestCase(TestCase):
+    """Requests are observed per route and action."""
+
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+
+    def test_metrics(self):
+        post = create_event('event')
+        client = APIClient()
+        with self.assertLogs('backend.api.metrics') as logs:
+            client.get('/api/posts/{}/'.format(post.id))
+        self.assertIn('"queries": 4', logs.output[0])
+
+        with self.assertLogs('backend.api.metrics'):
+            response = client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('api_request_queries_sum{action="retrieve",'
+                      'method="GET",route="post-detail"} 4',
+                      response.content.decode())
+
+        with self.assertLogs('backend.api.metrics'):
+            response = client.get('/api/metrics/', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(DB_HEALTH_CHECKS=True, DB_HEALTH_CHECK_IDLE=30)
+class ConnectionHealthTestCase(TransactionTestCase):
+    """Only connections idle for a while are checked before requests."""
+
+    def test_idle(self):
+        registry.clear()
+        connection = connections['default']
+        connection.ensure_connection()
+        checks = []
+
+        def is_usable():
+            checks.append(connection.alias)
+            return False
+
+        with mock.patch.object(connection, 'is_usable', is_usable):
+            mark_idle(None)
+            check_connections(None)
+            self.assertEqual(checks, [])
+            connection.idle_since -= 60
+            check_connections(None)
+            self.assertEqual(checks, ['default'])
+        self.assertIn('api_db_connections_unusable_total{alias="default"} 1',
+                      registry.render())
+
+
+class ReplicaTestCase(TransactionTestCase):
+    """Safe API requests read from a replica unless a write was recent."""
+
+    def setUp(self):
+        # a second alias of the test database stands in for the replica
+        connections.databases['replica0'] = dict(
+            connections['default'].settings_dict
+        )
+        self.addCleanup(self.remove_replica)
+        self.user = User.objects.create_superuser('admin',
+                                                  'admin@example.com',
+                                                  'password')
+        self.post = Post.objects.create(title='post', content='content')
+        cache.clear()
+        self.client = APIClient()
+
+    def remove_replica(self):
+        connections['replica0'].close()
+        del connections.databases['replica0']
+        del connections._connections.replica0
+
+    def queries(self, method, url, **kwargs):
+        """Response and number of queries per alias of a request."""
+        with CaptureQueriesContext(connections['default']) as default, \
+                CaptureQueriesContext(connections['replica0']) as replica:
+            response = getattr(self.client, method)(url, **kwargs)
+        return response, len(default), len(replica)
+
+    def test_routing(self):
+        url = '/api/posts/{}/'.format(self.post.id)
+        response, default, replica = self.queries('get', url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(default, 0)
+        self.assertGreater(replica, 0)
+
+        self.client.force_authenticate(self.user)
+        response, default, replica = self.queries(
+            'patch', url, data={'title': 'renamed'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(default, 0)
+        self.assertEqual(replica, 0)
+        self.assertIn('primary', response.cookies)
+
+        # sticky cookie, then anyone while the write is recent
+        response, default, replica = self.queries('get', url)
+        self.assertEqual(response.data['title'], 'renamed')
+        self.assertEqual(replica, 0)
+        del self.client.cookies['primary']
+        response, default, replica = self.queries('get', url)
+        self.assertEqual(replica, 0)
+        with override_settings(REPLICA_LAG=0):
+            response, default, replica = self.queries('get', url)
+        self.assertEqual(default, 0)
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles'
+                       '.storage.StaticFilesStorage')
+    def test_admin(self):
+        self.client.force_login(self.user)
+        response, default, replica = self.queries('get', '/admin/api/post/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(default, 0)
+        self.assertEqual(replica, 0)
+
+
+@override_settings(MEDIA_CONTENT_ADDRESSED=True,
+                   MEDIA_ROOT=tempfile.mkdtemp())
+class ContentAddressedMediaTestCase(TestCase):
+    """Identical uploads are stored once."""
+
+    def test_dedup(self):
+        post = Post.objects.create(title='post', content='content')
+        names = set()
+        for name in ('a.pdf', 'b.PDF'):
+            attachment = Attachment(post=post, name=name)
+            attachment.file.save(name, ContentFile(b'%PDF-1.4 content'))
+            names.add(attachment.file.name)
+        self.assertEqual(len(names), 1)
+        self.assertRegex(names.pop(), r'^cas/[0-9a-f]{2}/[0-9a-f]{64}\.pdf$')
+
+    def test_default_storage(self):
+        name = default_storage.save('markdownx/image.png', ContentFile(b'png'))
+        self.assertEqual(name, 'markdownx/image.png')
+
+
+@override_settings(IMAGE_VARIANTS_ASYNC=False, MEDIA_CONTENT_ADDRESSED=True,
+                   MEDIA_GC_GRACE=3600, MEDIA_ROOT=tempfile.mkdtemp())
+class MediaGarbageTestCase(TransactionTestCase):
+    """Unreferenced uploads are deleted, referenced ones never."""
+
+    def setUp(self):
+        self.post = Post.objects.create(title='post', content='content')
+
+    def attach(self, name, content):
+        attachment = Attachment(post=self.post, name=name)
+        attachment.file.save(name, ContentFile(content))
+        return attachment
+
+    def test_release(self):
+        first, second = [self.attach('a.pdf', b'%PDF-1.4 content')
+                         for _ in range(2)]
+        path = first.file.path
+        first.delete()
+        self.assertTrue(os.path.exists(path))
+        with self.settings(MEDIA_GC_GRACE=0):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_grace(self):
+        attachment = self.attach('a.pdf', b'%PDF-1.4 content')
+        attachment.delete()
+        # an upload of the same content may be about to reference it
+        self.assertTrue(os.path.exists(attachment.file.path))
+        call_command('collect_media_garbage', stdout=StringIO())
+        self.assertTrue(os.path.exists(attachment.file.path))
+        call_command('collect_media_garbage', grace=0, stdout=StringIO())
+        self.assertFalse(os.path.exists(attachment.file.path))
+
+    def test_collect(self):
+        kept = [self.attach('backup.tar.gz', b'archive'),
+                self.attach('a.csv', b'1,2,3\n' * 1000)]
+        with self.settings(MEDIA_CONTENT_ADDRESSED=False):
+            kept.append(self.attach('old.tar.gz', b'old archive'))
+        paths = [attachment.file.path for attachment in kept]
+        paths.append(kept[1].file.path + '.gz')
+        root = Path(upload_storage.path(''))
+        orphans = [root / 'orphan.pdf', root / 'removed.pdf.gz',
+                   root / 'cas' / 'upload.part']
+        for path in orphans:
+            path.write_bytes(b'content')
+
+        call_command('collect_media_garbage', grace=0, stdout=StringIO())
+        for path in paths:
+            self.assertTrue(os.path.exists(path), path)
+        for path in orphans:
+            self.assertFalse(path.exists(), path)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ContentExportTestCase(TestCase):
+    """Exported content imports back unchanged."""
+
+    def test_round_trip(self):
+        entities = [Entity.objects.create(name='entity {}'.format(i),
+                                          url='http://example.com', type=1)
+                    for i in range(3)]
+        posts = [create_event('event {}'.format(i), entities=entities)
+                 for i in range(3)]
+        attachment = posts[0].attachment_set.first()
+        attachment.file.save('a.pdf', ContentFile(b'%PDF-1.4 content'))
+        expected = self.client.get('/api/posts/').json()
+        directory = tempfile.mkdtemp()
+        output = '{}/content.ndjson'.format(directory)
+        media = '{}/media.tar'.format(directory)
+        call_command('export_content', output, media=media, chunk_size=2,
+                     stderr=StringIO())
+
+        Post.objects.all().delete()
+        Entity.objects.all().delete()
+        cache.clear()
+        call_command('import_content', output, chunk_size=2,
+                     stdout=StringIO())
+        self.assertEqual(self.client.get('/api/posts/').json(), expected)
+
+        attachment.refresh_from_db()
+        attachment.file.storage.delete(attachment.file.name)
+        empty = '{}/empty.ndjson'.format(directory)
+        open(empty, 'w').close()
+        call_command('import_content', empty, media=media, stdout=StringIO())
+        with attachment.file.open() as file:
+            self.assertEqual(file.read(), b'%PDF-1.4 content')
+
+    def test_existing_rows(self):
+        create_event('event')
+        output = '{}/content.ndjson'.format(tempfile.mkdtemp())
+        call_command('export_content', output, stderr=StringIO())
+        with self.assertRaisesRegex(CommandError, '^Lines up to 1: '):
+            call_command('import_content', output, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AttachmentDownloadTestCase(TestCase):
+    """Attachments download under their name, in ranges."""
+
+    def setUp(self):
+        cache.clear()
+        post = Post.objects.create(title='post', content='content')
+        self.attachment = Attachment(post=post, name='Regulamin „zawodów”')
+        self.attachment.file.save('a.pdf', ContentFile(b'0123456789'))
+        self.url = '/api/attachments/{}/download/'.format(self.attachment.id)
+
+    def test_download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="Regulamin zawodow.pdf"; filename*=UTF-8'
+            "''Regulamin%20%E2%80%9Ezawod%C3%B3w%E2%80%9D.pdf"
+        )
+        etag = response['ETag']
+
+        for range, status, content in (('bytes=2-4', 206, b'234'),
+                                       ('bytes=-3', 206, b'789'),
+                                       ('bytes=8-', 206, b'89'),
+                                       ('bytes=1-2,4-5', 200, b'0123456789'),
+                                       ('bytes=10-', 416, None)):
+            response = self.client.get(self.url, HTTP_RANGE=range)
+            self.assertEqual(response.status_code, status)
+            if content is not None:
+                self.assertEqual(b''.join(response.streaming_content),
+                                 content)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-4')
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-4',
+                                   HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-4',
+                                   HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT='/internal/media/')
+    def test_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/internal/media/' + self.attachment.file.name)
+        self.assertEqual(response.content, b'')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), IMAGE_VARIANTS_ASYNC=False)
+class PrecompressTestCase(TestCase):
+    """Compressible files get the same .gz sibling every run."""
+
+    def test_precompress(self):
+        directory = Path(tempfile.mkdtemp())
+        path = directory / 'a.txt'
+        path.write_bytes(b'content ' * 1000)
+        self.assertTrue(precompress(path))
+        sibling = directory / 'a.txt.gz'
+        compressed = sibling.read_bytes()
+        self.assertEqual(gzip.decompress(compressed), b'content ' * 1000)
+        sibling.unlink()
+        self.assertTrue(precompress(path))
+        self.assertEqual(sibling.read_bytes(), compressed)
+
+        for name, content in (('small.txt', b'content'),
+                              ('random.txt', os.urandom(4096))):
+            (directory / name).write_bytes(content)
+            self.assertFalse(precompress(directory / name))
+        self.assertEqual(sorted(path.name for path in directory.iterdir()),
+                         ['a.txt', 'a.txt.gz', 'random.txt', 'small.txt'])
+
+    def test_precompress_file(self):
+        post = Post.objects.create(title='post', content='content')
+        for name in ('a.csv', 'a.png'):
+            attachment = Attachment(post=post, name=name)
+            attachment.file.save(name, ContentFile(b'1,2,3\n' * 1000))
+            precompress_file(attachment.file)
+            self.assertEqual(
+                os.path.exists(attachment.file.path + '.gz'),
+                name == 'a.csv'
+            )
+
+    def test_static(self):
+        storage = CompressedManifestStaticFilesStorage(
+            location=tempfile.mkdtemp()
+        )
+        storage.save('app.css', ContentFile(b'body { color: red; }\n' * 100))
+        list(storage.post_process({'app.css': (storage, 'app.css')}))
+        hashed = storage.stored_name('app.css')
+        self.assertNotEqual(hashed, 'app.css')
+        for name in ('app.css', hashed):
+            self.assertTrue(os.path.exists(storage.path(name) + '.gz'))
@@ -1,10 +1,13 @@
 from django.urls import include, path
 
 from .router import router
-from .views import UploadView
+from .views import ChunkedUploadView, MetricsView, UploadView
 
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('metrics/', MetricsView.as_view()),
     path('upload/', UploadView.as_view()),
+    path('upload/chunked/', ChunkedUploadView.as_view()),
+    path('upload/chunked/<str:name>/', ChunkedUploadView.as_view()),
 ]
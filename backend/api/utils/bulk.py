@@ -0,0 +1,15 @@
+from django.db import connections, router
+
+
+def bulk_create(model, objs):
+    """Insert `objs` of `model`, setting their primary keys.
+
+    Backends returning ids from bulk inserts get a single query, others fall
+    back to one insert per object.
+    """
+    using = router.db_for_write(model)
+    if connections[using].features.can_return_ids_from_bulk_insert:
+        return model.objects.using(using).bulk_create(objs)
+    for obj in objs:
+        obj.save(force_insert=True, using=using)
+    return objs
@@ -0,0 +1,90 @@
+from pathlib import Path
+import gzip
+import logging
+import os
+import shutil
+
+from django.conf import settings
+
+from .variants import executor
+
+
+logger = logging.getLogger(__name__)
+
+# worth compressing, other types are compressed already
+COMPRESSIBLE = {
+    '.css', '.csv', '.htm', '.html', '.ico', '.js', '.json', '.map', '.md',
+    '.pdf', '.svg', '.txt', '.xml',
+}
+
+# siblings smaller than this share of the original are kept
+MAX_RATIO = .9
+
+MIN_SIZE = 1024
+
+
+def is_compressible(path):
+    """File worth precompressing, judged by its extension."""
+    return Path(path).suffix.lower() in COMPRESSIBLE
+
+
+def precompress(path):
+    """Write `.gz` sibling of file at `path`.
+
+    Served instead of the original by nginx `gzip_static`. The file is
+    compressed in chunks, a sibling not saving enough is removed. Returns
+    whether it was kept.
+    """
+    path = Path(path)
+    size = path.stat().st_size
+    if size < MIN_SIZE:
+        return False
+    sibling = path.with_name(path.name + '.gz')
+    # write aside and rename, so a sibling is never served half-done
+    partial = sibling.with_name(sibling.name + '.part')
+    try:
+        with path.open('rb') as source, partial.open('wb') as output:
+            # no name and no timestamp in the header, same bytes every run
+            with gzip.GzipFile(filename='', mode='wb', compresslevel=9,
+                               fileobj=output, mtime=0) as destination:
+                shutil.copyfileobj(source, destination)
+        if partial.stat().st_size > size * MAX_RATIO:
+            return False
+        os.replace(partial.as_posix(), sibling.as_posix())
+        return True
+    finally:
+        if partial.exists():
+            partial.unlink()
+
+
+def remove_precompressed(path):
+    """Remove sibling written by `precompress`."""
+    try:
+        os.remove('{}.gz'.format(path))
+    except FileNotFoundError:
+        pass
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error('Precompressing failed.', exc_info=future.exception())
+
+
+def precompress_file(file, wait=False):
+    """Precompress stored field file `file` unless done already.
+
+    Compressed in the variants process pool unless `wait` is set or
+    IMAGE_VARIANTS_ASYNC is off.
+    """
+    if not file or not is_compressible(file.name):
+        return
+    path = file.storage.path(file.name)
+    if os.path.exists('{}.gz'.format(path)):
+        return
+    if not wait and settings.IMAGE_VARIANTS_ASYNC:
+        executor().submit(precompress, path).add_done_callback(_log_failure)
+        return
+    try:
+        precompress(path)
+    except OSError:
+        logger.error('Precompressing %s failed.', file.name, exc_info=True)
@@ -0,0 +1,111 @@
+from pathlib import PurePosixPath
+from urllib.parse import quote
+import mimetypes
+import os
+import re
+import unicodedata
+
+from django.http import FileResponse, HttpResponse
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def download_name(name, stored_name):
+    """File name offered for download, `name` with the stored extension."""
+    suffix = PurePosixPath(stored_name).suffix
+    name = name.strip() or PurePosixPath(stored_name).stem
+    return name if name.lower().endswith(suffix.lower()) else name + suffix
+
+
+def content_disposition(filename):
+    """`attachment` header value, non-ASCII names go to filename*."""
+    fallback = unicodedata.normalize('NFKD', filename)\
+        .encode('ascii', 'ignore').decode()\
+        .replace('\\', '').replace('"', '')
+    value = 'attachment; filename="{}"'.format(fallback)
+    if fallback != filename:
+        value += "; filename*=UTF-8''{}".format(quote(filename))
+    return value
+
+
+def content_type(filename):
+    """Media type guessed from the file extension."""
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def byte_range(header, size):
+    """First and last byte of a single `bytes=` range of `size` bytes.
+
+    None when the whole file should be sent, multiple or malformed ranges
+    included. Raises ValueError when the range is unsatisfiable.
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # suffix range, the last bytes
+        if not int(last):
+            raise ValueError
+        return max(size - int(last), 0), size - 1
+    if last and int(last) < int(first):
+        return None
+    if int(first) >= size:
+        raise ValueError
+    return int(first), min(int(last), size - 1) if last else size - 1
+
+
+class _Slice(object):
+    """File object reading at most `length` bytes from the current offset."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        """Read up to `size` bytes, not past the slice."""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        """Close the underlying file."""
+        self.file.close()
+
+
+def accel_response(location, filename):
+    """Empty response handing the transfer of `location` to nginx."""
+    response = HttpResponse(content_type=content_type(filename))
+    response['X-Accel-Redirect'] = quote(location)
+    response['Content-Disposition'] = content_disposition(filename)
+    return response
+
+
+def file_response(path, filename, range_header=None):
+    """Stream file at `path`, or the byte range requested."""
+    size = os.path.getsize(path)
+    try:
+        requested = byte_range(range_header, size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(size)
+        return response
+    file = open(path, 'rb')
+    if requested is None:
+        response = FileResponse(file, content_type=content_type(filename))
+        response['Content-Length'] = size
+    else:
+        first, last = requested
+        file.seek(first)
+        response = FileResponse(_Slice(file, last - first + 1),
+                                status=206,
+                                content_type=content_type(filename))
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(first, last,
+                                                            size)
+        response['Content-Length'] = last - first + 1
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = content_disposition(filename)
+    return response
@@ -0,0 +1,23 @@
+from pathlib import Path
+import os
+
+from django.conf import settings
+
+
+def temporary_path(name):
+    """Path of a file uploaded to media/tmp."""
+    return Path(settings.MEDIA_ROOT) / 'tmp' / Path(name).name
+
+
+def move_uploaded(name, field, instance=None):
+    """Move uploaded file to the destination of model `field`.
+
+    The file is renamed, not copied, and the storage name is returned.
+    """
+    destination = field.generate_filename(instance, Path(name).name)
+    if hasattr(field.storage, 'move_into'):
+        return field.storage.move_into(temporary_path(name), destination)
+    path = Path(field.storage.path(destination))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(temporary_path(name).as_posix(), path.as_posix())
+    return destination
@@ -0,0 +1,81 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path, PurePosixPath
+import logging
+import os
+import threading
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_name(name, variant):
+    """Storage name of `variant` of image stored as `name`."""
+    return (PurePosixPath('variants')
+            / variant
+            / PurePosixPath(name).with_suffix('.webp').name).as_posix()
+
+
+def render_variants(source, targets, quality):
+    """Render WEBP variants of image at path `source`.
+
+    `targets` holds (path, (width, height)) pairs. Runs in a worker process,
+    so it gets plain paths only and does not touch Django.
+    """
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if 'A' in image.getbands()
+                              or 'transparency' in image.info else 'RGB')
+        for path, size in targets:
+            variant = image.copy()
+            variant.thumbnail(size, Image.LANCZOS)
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            # write aside and rename, so a variant is never served half-done
+            partial = '{}.part'.format(path)
+            variant.save(partial, 'WEBP', quality=quality)
+            os.replace(partial, path)
+
+
+def executor():
+    """Process pool for work on stored files, shared by threaded workers."""
+    global _executor
+    with _executor_lock:  # threaded workers share one pool
+        if _executor is None:  # created lazily, after server workers fork
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_VARIANTS_WORKERS
+            )
+    return _executor
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error('Rendering image variants failed.',
+                     exc_info=future.exception())
+
+
+def build_variants(image, wait=False):
+    """Render missing variants of `image`, a stored image field file.
+
+    Rendering goes to the process pool unless `wait` is set or
+    IMAGE_VARIANTS_ASYNC is off.
+    """
+    if not image:
+        return
+    targets = [
+        (image.storage.path(variant_name(image.name, variant)), size)
+        for variant, size in settings.IMAGE_VARIANTS.items()
+        if not image.storage.exists(variant_name(image.name, variant))
+    ]
+    if not targets:
+        return
+    args = (image.path, targets, settings.IMAGE_VARIANTS_QUALITY)
+    if wait or not settings.IMAGE_VARIANTS_ASYNC:
+        render_variants(*args)
+    else:
+        executor().submit(render_variants, *args)\
+            .add_done_callback(_log_failure)
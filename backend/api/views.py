@@ -1,37 +1,82 @@
+from collections import OrderedDict
+from datetime import datetime, time, timedelta
 from pathlib import Path
+import base64
+import hashlib
 
+from django.conf import settings
 from django.core.files.storage import default_storage
+from django.http import Http404, HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.functional import cached_property
+from django.utils.http import http_date
 from rest_framework import status, views, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
-from .models import Attachment, Entity, Post, TYPES_ENTITIES
+from . import feed
+from .caching import cache_response
+from .metrics import registry
+from .mixins import BulkMixin, CachedResponseMixin, ConditionalGetMixin
+from .models import (ENTITY_TYPES,
+                     Attachment,
+                     Entity,
+                     EventDetails,
+                     Post,
+                     PostFeed,
+                     TYPES_ENTITIES)
+from .pagination import PostsCursorPagination, PostsSearchPagination
+from .permissions import IsInternalAddress
+from .renderers import ICalendarRenderer
+from .search import search_posts
 from .serializers import (AttachmentsSerializer,
+                          AttachmentsSerializerUseUploadedFile,
+                          ChunkedUploadSerializer,
                           EntitiesSerializer,
+                          EntitiesSerializerUseUploadedImage,
+                          EventsSerializerCalendar,
+                          EventsSerializerICalendar,
+                          PostFeedSerializer,
                           PostsSerializer,
                           PostsSerializerList,
                           PostsSerializerMarkdownifyContent,
+                          PostsSerializerSlider,
                           PostsSerializerUseUploadedHeader)
+from .utils.downloads import accel_response, download_name, file_response
+from .utils.uploads import temporary_path
+from .utils.uuid4path import Uuid4Path
 
 
-class _Choices(object):
+def _query_datetime(params, name, end_of_day=False):
+    """Datetime query param, a date alone means its start or end."""
+    value = params.get(name)
+    try:
+        parsed = parse_datetime(value) or datetime.combine(
+            parse_date(value), time.max if end_of_day else time.min
+        )
+    except (TypeError, ValueError):
+        raise ValidationError({name: 'Niepoprawny format daty.'})
+    return parsed if timezone.is_aware(parsed)\
+        else timezone.make_aware(parsed)
 
-    __slots__ = (
-        '_choices',
-    )
 
-    def __init__(self, choices):
-        self._choices = choices
+class MetricsView(views.APIView):
+    """API endpoint for scraping request metrics, Prometheus format."""
 
-    @property
-    def values(self):
-        return [c[1] for c in self._choices]
+    authentication_classes = ()
+    permission_classes = (IsInternalAddress, )
 
-    def key(self, value):
-        try:
-            return [c[0] for c in self._choices if c[1] == value][0]
-        except IndexError:
-            return -1
+    def get(self, request, format=None):
+        """GET method."""
+        if not settings.API_METRICS:
+            raise Http404
+        return HttpResponse(registry.render(),
+                            content_type='text/plain; version=0.0.4')
 
 
 class UploadView(views.APIView):
@@ -49,11 +94,106 @@ class UploadView(views.APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class AttachmentsViewset(viewsets.ModelViewSet):
+class ChunkedUploadView(views.APIView):
+    """API endpoint for resumable, chunked file upload.
+
+    POST starts an upload and returns its name. PATCH appends the raw
+    request body at the `Upload-Offset` header, verified against the
+    optional `Content-MD5` header; 409 reports the expected offset, 413
+    an upload growing past MEDIA_UPLOAD_MAX_SIZE. GET
+    returns the offset to resume from. The name is then used as uploaded
+    `header` of a post or `file` of an attachment.
+    """
+
+    chunk_size = 64 * 1024
+    permission_classes = (IsAuthenticated, )
+
+    def get(self, request, name, format=None):
+        """GET method."""
+        return self._offset_response(self._path(name))
+
+    def patch(self, request, name, format=None):
+        """PATCH method."""
+        path = self._path(name)
+        offset = path.stat().st_size
+        try:
+            if int(request.META['HTTP_UPLOAD_OFFSET']) != offset:
+                return self._offset_response(path,
+                                             status.HTTP_409_CONFLICT)
+        except (KeyError, ValueError):
+            return Response({'detail': 'Brak poprawnego Upload-Offset.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        limit = settings.MEDIA_UPLOAD_MAX_SIZE - offset
+        try:
+            if int(request.META.get('CONTENT_LENGTH') or 0) > limit:
+                return self._too_large_response()
+        except ValueError:
+            pass
+        checksum = hashlib.md5()
+        # request.stream is None for an empty body
+        chunks = iter(lambda: request.stream.read(self.chunk_size), b'')\
+            if request.stream else ()
+        with path.open('ab') as destination:
+            for chunk in chunks:
+                limit -= len(chunk)
+                if limit < 0:
+                    # sent without a length, or longer than it
+                    destination.truncate(offset)
+                    return self._too_large_response()
+                checksum.update(chunk)
+                destination.write(chunk)
+            expected = request.META.get('HTTP_CONTENT_MD5')
+            if expected and expected != base64.b64encode(checksum.digest())\
+                    .decode():
+                destination.truncate(offset)
+                return Response({'detail': 'Niepoprawna suma kontrolna.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        return self._offset_response(path)
+
+    def post(self, request, format=None):
+        """POST method."""
+        serializer = ChunkedUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        path = temporary_path(
+            Uuid4Path()(None, serializer.validated_data['filename'])
+        )
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+        return self._offset_response(path, status.HTTP_201_CREATED)
+
+    def _offset_response(self, path, code=status.HTTP_200_OK):
+        return Response({'name': path.name, 'offset': path.stat().st_size},
+                        status=code)
+
+    def _too_large_response(self):
+        return Response({'detail': 'Plik jest za duży.'},
+                        status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def _path(self, name):
+        path = temporary_path(name)
+        if not path.is_file():
+            raise Http404
+        return path
+
+
+class AttachmentsViewset(BulkMixin,
+                         CachedResponseMixin,
+                         ConditionalGetMixin,
+                         viewsets.ModelViewSet):
     """API endpoint for attachments."""
 
+    cache_namespace = 'attachments'
+    cache_query_params = ('post', )
     queryset = Attachment.objects.all()
-    serializer_class = AttachmentsSerializer
+
+    def get_serializer_class(self):
+        """Pick serializer class."""
+        data = self.request.data
+        if self.action == 'bulk'\
+                or isinstance(data, dict)\
+                and isinstance(data.get('file', None), str):
+            return AttachmentsSerializerUseUploadedFile
+        return AttachmentsSerializer
 
     def get_queryset(self):
         """Filtering."""
@@ -65,31 +205,118 @@ class AttachmentsViewset(viewsets.ModelViewSet):
             pass
         return qs.filter(post=id) if id and self.action == 'list' else qs
 
+    @action(detail=True)
+    def download(self, request, pk=None):
+        """Attachment file named after the attachment, `Range` aware.
+
+        nginx sends the bytes when MEDIA_ACCEL_REDIRECT is set.
+        """
+        attachment = self.get_object()
+        filename = download_name(attachment.name, attachment.file.name)
+        validators = (attachment.file.name, )
+
+        def view():
+            if settings.MEDIA_ACCEL_REDIRECT:
+                return accel_response(
+                    settings.MEDIA_ACCEL_REDIRECT + attachment.file.name,
+                    filename
+                )
+            # ranges of a changed file would not fit the client copy
+            if_range = request.META.get('HTTP_IF_RANGE')
+            ranged = not if_range or if_range in (
+                self.etag(request, attachment.updated, validators),
+                http_date(int(attachment.updated.timestamp())),
+            )
+            try:
+                return file_response(
+                    attachment.file.path,
+                    filename,
+                    request.META.get('HTTP_RANGE') if ranged else None
+                )
+            except FileNotFoundError:
+                raise Http404
 
-class EntitiesViewset(viewsets.ModelViewSet):
+        return self.conditional_response(request, attachment.updated,
+                                         validators, view)
+
+
+class EntitiesViewset(BulkMixin,
+                      CachedResponseMixin,
+                      ConditionalGetMixin,
+                      viewsets.ModelViewSet):
     """API endpoint for entities."""
 
+    cache_namespace = 'entities'
+    cache_query_params = ('type', )
     queryset = Entity.objects.all().order_by('name')
-    serializer_class = EntitiesSerializer
+
+    def get_serializer_class(self):
+        """Pick serializer class."""
+        data = self.request.data
+        if self.action == 'bulk'\
+                or isinstance(data, dict)\
+                and isinstance(data.get('image', None), str):
+            return EntitiesSerializerUseUploadedImage
+        return EntitiesSerializer
 
     def get_queryset(self):
         """Filtering."""
-        choices = _Choices(TYPES_ENTITIES)
         qs = super().get_queryset()
-        type = str(self.request.query_params.get('type')).lower()
-        return qs.filter(type=choices.key(type)) if type in choices.values\
-            else qs
+        type = ENTITY_TYPES.get(
+            str(self.request.query_params.get('type')).lower()
+        )
+        return qs.filter(type=type) if type is not None else qs
 
+    @action(detail=False, pagination_class=None)
+    @cache_response
+    def directory(self, request):
+        """All entities by type name, each type ordered by name."""
+        qs = Entity.objects.order_by('type', 'name')
+        directory = OrderedDict((name, []) for _, name in TYPES_ENTITIES)
+        names = dict(TYPES_ENTITIES)
+        for data in self.get_serializer(qs, many=True).data:
+            directory[names[data['type']]].append(data)
+        return Response(directory)
 
-class PostsViewset(viewsets.ModelViewSet):
+
+class PostsViewset(CachedResponseMixin,
+                   ConditionalGetMixin,
+                   viewsets.ModelViewSet):
     """API endpoint for posts."""
 
+    cache_namespace = 'posts'
+    cache_query_params = ('cursor', 'expand', 'fields', 'format', 'from',
+                          'markdownify', 'ongoing', 'only', 'page',
+                          'page_size', 'q', 'to', 'upcoming')
+    # columns backing serializer fields not named after one
+    field_columns = {
+        'content': ('content', 'content_html'),
+        'header_variants': ('header', ),
+    }
+    # lookups loading related serializer fields, None joins
+    field_relations = {
+        'attachment_count': 'attachment_set',
+        'attachment_set': 'attachment_set',
+        'eventdetails': None,
+        'eventparticipants_set': 'eventparticipants_set__entities',
+        'participant_labels': 'eventparticipants_set',
+    }
+    pagination_class = PostsCursorPagination
     queryset = Post.objects.all().order_by('-id')
+    sparse_actions = ('list', 'retrieve', 'search')
 
     def get_serializer_class(self):
         """Pick serializer class."""
-        if self.action == 'list':
+        if self.uses_feed:
+            serializer = PostFeedSerializer
+        elif self.action in ('list', 'search'):
             serializer = PostsSerializerList
+        elif self.action == 'slider':
+            serializer = PostsSerializerSlider
+        elif self.action == 'events':
+            serializer = EventsSerializerICalendar\
+                if self.request.accepted_renderer.format == 'ics'\
+                else EventsSerializerCalendar
         else:
             if self.request.data.get('header', None)\
                 and isinstance(self.request.data['header'],
@@ -103,7 +330,19 @@ class PostsViewset(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Filtering."""
+        if self.uses_feed:
+            qs = PostFeed.objects.all()
+            only = str(self.request.query_params.get('only')).lower()
+            if only in ('events', 'posts'):
+                qs = qs.filter(event=only == 'events')
+            return qs.order_by('-id')
         qs = super().get_queryset()
+        if self.sparse_fields is not None:
+            qs = self._load_fields(qs, *self.sparse_fields)
+        else:
+            qs = qs.select_related('eventdetails')\
+                .prefetch_related('attachment_set',
+                                  'eventparticipants_set__entities')
         only = str(self.request.query_params.get('only')).lower()
         fs = {  # filters
             'events': {'eventdetails__isnull': False},
@@ -112,3 +351,140 @@ class PostsViewset(viewsets.ModelViewSet):
         return qs.filter(**fs[only]).order_by('-id')\
             if only in fs.keys()\
             else qs.order_by('-id')
+
+    def get_serializer_context(self):
+        """Extra context provided to the serializer class."""
+        context = super().get_serializer_context()
+        if self.sparse_fields is not None:
+            context['fields'], context['expand'], _ = self.sparse_fields
+        return context
+
+    def perform_create(self, serializer):
+        """Create, refreshing the feed row once."""
+        with feed.batched():
+            super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        """Update, refreshing the feed row once."""
+        with feed.batched():
+            super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        """Destroy, dropping the feed row once."""
+        with feed.batched():
+            super().perform_destroy(instance)
+
+    @cached_property
+    def uses_feed(self):
+        """List of default fields, read from the precomputed feed."""
+        params = self.request.query_params
+        return self.action == 'list'\
+            and self.request.method in SAFE_METHODS\
+            and not params.get('fields')\
+            and not params.get('expand')
+
+    @cached_property
+    def sparse_fields(self):
+        """Validated `fields` and `expand` query params.
+
+        Returns the sets of both, `fields` is empty when not given, and the
+        set of all fields to be serialized. None for write requests and
+        lists read from the feed.
+        """
+        if self.request.method not in SAFE_METHODS\
+                or self.action not in self.sparse_actions\
+                or self.uses_feed:
+            return None
+        serializer_class = self.get_serializer_class()
+        expandable = set(serializer_class.expandable_fields)
+        default = set(serializer_class().fields)
+        fields, expand = (
+            {name for name in self.request.query_params.get(param, '')
+             .split(',') if name}
+            for param in ('fields', 'expand')
+        )
+        errors = {
+            param: 'Nieznane pola: {}.'.format(', '.join(sorted(unknown)))
+            for param, unknown in (('fields', fields - default - expandable),
+                                   ('expand', expand - expandable))
+            if unknown
+        }
+        if errors:
+            raise ValidationError(errors)
+        return fields, expand, (fields or default) | expand
+
+    def _load_fields(self, qs, fields, expand, names):
+        # load only columns and relations serialized fields are made of
+        qs = qs.prefetch_related(*{
+            lookup for name, lookup in self.field_relations.items()
+            if name in names and lookup
+        })
+        if 'eventdetails' in names:
+            qs = qs.select_related('eventdetails')
+        if not fields:
+            deferred = {'content', 'content_html', 'search_vector'}
+            if 'content' in names:
+                deferred -= set(self.field_columns['content'])
+            return qs.defer(*deferred)
+        # conditional GET reads `updated` of retrieved post
+        columns = {'id', self.updated_field}
+        for name in names - set(self.field_relations):
+            columns.update(self.field_columns.get(name, (name, )))
+        return qs.only(*columns)
+
+    @action(detail=False, pagination_class=PostsSearchPagination)
+    @cache_response
+    def search(self, request):
+        """Full-text search over title and content, `q` is the query."""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'To pole jest wymagane.'})
+        page = self.paginate_queryset(
+            search_posts(self.filter_queryset(self.get_queryset()), query)
+        )
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, pagination_class=None)
+    @cache_response
+    def slider(self, request):
+        """Newest slider posts, at most SLIDER_SIZE of them."""
+        qs = Post.objects\
+            .filter(slider=True)\
+            .only('id', 'title', 'header')\
+            .order_by('-id')[:settings.SLIDER_SIZE]
+        return Response(self.get_serializer(qs, many=True).data)
+
+    @action(detail=False,
+            pagination_class=None,
+            renderer_classes=list(api_settings.DEFAULT_RENDERER_CLASSES)
+            + [ICalendarRenderer])
+    @cache_response
+    def events(self, request, *args, **kwargs):
+        """Events calendar feed ordered by start, also as .ics.
+
+        `from` and `to` pick events overlapping the window, `upcoming` the
+        ones yet to start, `ongoing` the ones taking place now. A missing
+        bound is EVENTS_WINDOW_DAYS away from the other one, or from now.
+        """
+        params = request.query_params
+        now = timezone.now()
+        window = timedelta(days=settings.EVENTS_WINDOW_DAYS)
+        start = _query_datetime(params, 'from') if 'from' in params\
+            else None
+        end = _query_datetime(params, 'to', end_of_day=True)\
+            if 'to' in params else None
+        if start is None:
+            start = (end or now) - window
+        if end is None:
+            end = start + window if 'from' in params else now + window
+        qs = EventDetails.objects\
+            .select_related('post')\
+            .only('start', 'end', 'place', 'post', 'post__title')\
+            .filter(end__gte=start, start__lte=end)\
+            .order_by('start', 'id')
+        if 'upcoming' in params:
+            qs = qs.filter(start__gt=now)
+        if 'ongoing' in params:
+            qs = qs.filter(start__lte=now, end__gte=now)
+        return Response(self.get_serializer(qs, many=True).data)
@@ -7,6 +7,7 @@ do
 done
 
 python ./manage.py migrate
+python ./manage.py rebuild_post_feed
 python ./manage.py runserver 0.0.0.0:8000
 
 exec "$@"
@@ -7,6 +7,11 @@ do
 done
 
 python ./manage.py migrate
+python ./manage.py createcachetable
+python ./manage.py markdownify_posts
+python ./manage.py rebuild_post_feed
+python ./manage.py build_image_variants
+python ./manage.py precompress_media
 python ./manage.py collectstatic --no-input
 
 exec "$@"
@@ -0,0 +1,32 @@
+"""
+Gunicorn config for backend project.
+
+Threaded workers keep serving other requests while one waits on the
+database or a slow client, so concurrency grows with GUNICORN_THREADS rather
+than with processes.
+
+For more information on this file, see
+https://docs.gunicorn.org/en/20.1.0/settings.html
+"""
+
+import multiprocessing
+import os
+import sys
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS',
+                             multiprocessing.cpu_count() + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# recycle workers now and then, staggered so they never restart together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+
+def pre_fork(server, worker):
+    """Never hand database connections of the master over to workers."""
+    if 'django.db' in sys.modules:
+        from django.db import connections
+        connections.close_all()